@@ -0,0 +1,25 @@
+import os
+import logging
+
+try:
+    import redis.asyncio as redis_asyncio
+except Exception:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# 共用的 Redis 連線 (chat_router 的對話 / 回覆快取與 tools 的查詢結果快取共用同一個連線池)
+_redis_client = None
+
+
+def get_redis_client():
+    """
+    設定了 REDIS_URL 時回傳共用的 redis.asyncio 客戶端，否則 (或未安裝 redis) 回傳 None。
+    客戶端在第一次使用時才建立，確保讀取 REDIS_URL 時 .env 已經載入。
+    """
+    global _redis_client
+    if _redis_client is None and redis_asyncio is not None:
+        url = os.getenv("REDIS_URL")
+        if url:
+            _redis_client = redis_asyncio.Redis.from_url(url)
+    return _redis_client
@@ -1,11 +1,20 @@
 from typing import List, Optional
+import asyncio
+from collections import deque
+import hashlib
 import os
 import logging
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import json
-from chroma_manager import chroma_manager, get_chroma_db
+import re
+import time
+import orjson
+from chroma_manager import chroma_manager, embed_queries, get_chroma_db
 from pcr_services import get_pcr_records_from_chroma
+from semantic_cache import SemanticCache
+from cache import get_redis_client
 from pydantic import BaseModel
 
 try:
@@ -47,16 +56,95 @@ class ChatRequest(BaseModel):
 
 
 # Simple in-memory session store: { session_id: [ {role, content}, ... ] }
+# Used as a fallback when REDIS_URL is not configured or redis is not installed.
 SESSIONS = {}
 
+# Only the most recent messages are kept per session / sent to the model
+# (session histories are deque(maxlen=MAX_SESSION_MESSAGES), so old messages are evicted on append)
+MAX_SESSION_MESSAGES = 40
 
-def call_gemini_prompt(prompt_text: str) -> str:
+_genai_client = None
+
+
+def llm_cache_key(model: str, prompt_text: str) -> str:
+    return "llm:" + hashlib.sha256((model + "\n" + prompt_text).encode("utf-8")).hexdigest()
+
+
+async def get_cached_llm_reply(model: str, prompt_text: str) -> Optional[str]:
+    """Return a cached model reply for exactly this model + prompt, if Redis is configured."""
+    client = get_redis_client()
+    if client is None:
+        return None
+    cached = await client.get(llm_cache_key(model, prompt_text))
+    return cached.decode("utf-8") if cached else None
+
+
+async def set_cached_llm_reply(model: str, prompt_text: str, reply_text: str) -> None:
+    """Cache a model reply with a short TTL (LLM_CACHE_TTL_SECONDS, default 600)."""
+    client = get_redis_client()
+    if client is None:
+        return
+    ttl = int(os.getenv("LLM_CACHE_TTL_SECONDS", "600"))
+    await client.set(llm_cache_key(model, prompt_text), reply_text, ex=ttl)
+
+
+# Semantic cache in front of the Chroma retrieval: paraphrased / repeated searches
+# (cosine similarity >= 0.95) reuse the previous records instead of re-querying the index.
+pcr_search_cache = SemanticCache(threshold=0.95, max_entries=512)
+
+
+async def load_session(sid: str) -> deque:
+    """Load the message history of a session (Redis if available, else in-memory)."""
+    client = get_redis_client()
+    if client is None:
+        history = SESSIONS.get(sid)
+        if history is None:
+            history = SESSIONS[sid] = deque(maxlen=MAX_SESSION_MESSAGES)
+        return history
+    raw = await client.get(f"sess:{sid}")
+    return deque(orjson.loads(raw) if raw else (), maxlen=MAX_SESSION_MESSAGES)
+
+
+async def save_session(sid: str, history: deque) -> None:
+    """Persist the (already bounded) message history of a session with a TTL."""
+    client = get_redis_client()
+    if client is None:
+        # in-memory history is mutated in place; nothing to write back
+        return
+    ttl = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    await client.set(f"sess:{sid}", orjson.dumps(list(history)), ex=ttl)
+
+
+def get_genai_client():
+    """
+    Return a shared google-genai client.
+    Created once (lazily, after .env is loaded) so the underlying HTTP connection pool is reused across requests.
+    """
+    global _genai_client
+    if _genai_client is None:
+        # Optionally pass api_key to client; the SDK may also use ADC
+        api_key = os.getenv("GEMINI_API_KEY")
+        _genai_client = genai.Client(api_key=api_key) if api_key else genai.Client()
+    return _genai_client
+
+
+async def generate_content(model: str, contents: str, with_tools: bool = False):
+    """Call Gemini generate_content through the shared async client (optionally with the PCR tool config)."""
+    client = get_genai_client()
+    if with_tools:
+        return await client.aio.models.generate_content(
+            model=model, contents=contents, config=get_genai_tool_config()
+        )
+    return await client.aio.models.generate_content(model=model, contents=contents)
+
+
+async def call_gemini_prompt(prompt_text: str) -> str:
     """
     Call Gemini using the official google-genai client only.
     This function requires the `google-genai` package to be installed.
+    Uses the SDK's async client so the event loop is not blocked during the round-trip.
     """
     model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-    api_key = os.getenv("GEMINI_API_KEY")
 
     if genai is None:
         raise RuntimeError(
@@ -64,13 +152,7 @@ def call_gemini_prompt(prompt_text: str) -> str:
         )
 
     try:
-        # Optionally pass api_key to client; the SDK may also use ADC
-        if api_key:
-            client = genai.Client(api_key=api_key)
-        else:
-            client = genai.Client()
-
-        response = client.models.generate_content(model=model, contents=prompt_text)
+        response = await generate_content(model, prompt_text)
         # Try common access patterns
         text = getattr(response, "text", None)
         if text:
@@ -94,27 +176,191 @@ def call_gemini_prompt(prompt_text: str) -> str:
         raise RuntimeError(f"google-genai client call failed: {e}")
 
 
+# Lines that mention pcr_chroma_search or '工具' followed by function-like tokens (compiled once)
+_INTERNAL_LINE_RE = re.compile(r"pcr_chroma_search|工具.*已執行", re.IGNORECASE)
+# Same rule applied to a whole reply in one sweep (also removes the line break)
+_SANITIZE_RE = re.compile(r"^.*(?:pcr_chroma_search|工具.*已執行).*(?:\n|$)", re.IGNORECASE | re.MULTILINE)
+
+
+def _is_internal_line(ln: str) -> bool:
+    """True for reply lines that mention the internal tool implementation."""
+    return _INTERNAL_LINE_RE.search(ln) is not None
+
+
 def sanitize_reply(text: str) -> str:
     """Remove internal tool/function names or boilerplate that mentions the tool implementation.
     Keeps document citations but strips phrases like '工具 pcr_chroma_search 已執行' or explicit function names."""
     if not text:
         return text
-    # remove lines that mention pcr_chroma_search or '工具' followed by function-like tokens
-    import re
-
-    lines = text.splitlines()
-    cleaned_lines = []
-    for ln in lines:
-        if re.search(r"pcr_chroma_search", ln, re.IGNORECASE):
-            continue
-        if re.search(r"工具[^\n]*已執行", ln):
-            continue
-        cleaned_lines.append(ln)
-    cleaned = "\n".join(cleaned_lines).strip()
-    return cleaned
-
-
-@router.post("/api/chat")
+    return _SANITIZE_RE.sub("", text).strip()
+
+
+class StreamSanitizer:
+    """Line-buffered version of sanitize_reply for streamed replies: a line is only
+    emitted once it is complete, so internal-tool lines can still be dropped."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        if "\n" not in self._buffer:
+            return ""
+        complete, self._buffer = self._buffer.rsplit("\n", 1)
+        lines = complete.split("\n")
+        return "".join(ln + "\n" for ln in lines if not _is_internal_line(ln))
+
+    def flush(self) -> str:
+        rest, self._buffer = self._buffer, ""
+        return "" if _is_internal_line(rest) else rest
+
+
+# function declaration for the model
+PCR_SEARCH_FUNC_DECL = {
+    "name": "pcr_chroma_search",
+    "description": "Search PCR records using Chroma vector index. Returns list of records with title, developer, regno and snippet.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "search": {"type": "string", "description": "search query"},
+            "limit": {"type": "integer", "description": "max documents to return"},
+        },
+        "required": ["search"],
+    },
+}
+
+
+class PCRToolError(Exception):
+    """Raised when the PCR search tool cannot run; carries the reply for the user
+    and the note recorded in the session history."""
+
+    def __init__(self, reply: str, history_note: str):
+        super().__init__(reply)
+        self.reply = reply
+        self.history_note = history_note
+
+
+def new_session_id() -> str:
+    # create a simple session id (timestamp-based)
+    return str(int(time.time() * 1000))
+
+
+def build_prompt_text(history: deque) -> str:
+    """Build the model prompt from the session history (at most MAX_SESSION_MESSAGES messages)."""
+    conversation = "\n".join(
+        f"[{m.get('role', 'user')}] {m.get('content', '')}" for m in history
+    )
+    # Prepend the server-side system instructions to ensure consistent assistant behavior
+    return f"{SYSTEM_PROMPT}\n\n{conversation}\n\nAssistant:"
+
+
+def get_genai_tool_config():
+    tool = types.Tool(function_declarations=[PCR_SEARCH_FUNC_DECL])
+    return types.GenerateContentConfig(tools=[tool])
+
+
+def find_function_call(response):
+    """Inspect candidates.content.parts of a model response (or stream chunk) and return the first function_call, if any."""
+    try:
+        cands = getattr(response, "candidates", []) or []
+        logger.debug("genai returned %s candidates", len(cands))
+        # Iterate candidates and their parts to find function_call or text parts
+        for ci, cand in enumerate(cands):
+            parts = getattr(cand.content, "parts", []) or []
+            logger.debug("candidate[%s] has %s parts", ci, len(parts))
+            for pi, part in enumerate(parts):
+                # Log available attributes for debugging
+                text = getattr(part, "text", None)
+                fc = getattr(part, "function_call", None)
+                ts = getattr(part, "thought_signature", None)
+                logger.info(
+                    "candidate[%s].part[%s] text=%s func_call=%s thought_signature=%s",
+                    ci, pi, bool(text), bool(fc), bool(ts),
+                )
+                if text:
+                    logger.debug("part text (truncated): %.400s", text)
+                if ts:
+                    logger.debug("thought_signature: %s", ts)
+                if fc:
+                    # found a function call
+                    logger.info(
+                        "Found function_call in candidate[%s].part[%s]: name=%s",
+                        ci, pi, getattr(fc, "name", None),
+                    )
+                    return fc
+    except Exception as e:
+        logger.exception("Error while inspecting model response parts: %s", e)
+    return None
+
+
+async def run_pcr_search_tool(func_call) -> list:
+    """Execute a pcr_chroma_search function call and return the results passed back to the model."""
+    raw_args = getattr(func_call, "args", "{}")
+    try:
+        args = json.loads(raw_args) if isinstance(raw_args, str) else raw_args
+    except Exception:
+        args = {}
+
+    search_text = str(args.get("search", "")).strip()
+    limit = int(args.get("limit", 3)) if args.get("limit") else 3
+    limit = max(1, min(limit, 10))
+
+    # ensure chroma
+    if not chroma_manager.is_initialized:
+        try:
+            chroma_manager.initialize_db()
+        except Exception as init_err:
+            logger.error("初始化 ChromaDB 失敗: %s", init_err)
+            raise PCRToolError("無法存取檔案索引。請稍後再試。", "(執行工具時發生錯誤，無法存取檔案索引)")
+
+    db = get_chroma_db()
+    try:
+        # SentenceTransformer inference is synchronous CPU work; keep it off the event loop
+        query_vec = (await asyncio.to_thread(embed_queries, [search_text]))[0]
+        records = pcr_search_cache.lookup(query_vec, limit)
+        if records is None:
+            # limit is part of the cache key, so it must actually bound the number of documents returned
+            records = await get_pcr_records_from_chroma(
+                db,
+                skip=0,
+                limit=limit,
+                search=search_text,
+                query_embedding=query_vec,
+                top_n_documents=limit,
+            )
+            pcr_search_cache.store(query_vec, limit, records)
+    except Exception as e:
+        logger.exception("Chroma 檢索失敗: %s", e)
+        raise PCRToolError("檢索時發生錯誤。", "(執行工具時發生錯誤)")
+
+    func_result = []
+    for r in records:
+        func_result.append({
+            "document_name": getattr(r, "document_name", ""),
+            "developer": getattr(r, "developer", ""),
+            "pcr_reg_no": getattr(r, "pcr_reg_no", ""),
+            "snippet": (getattr(r, "page_content", "") or "")[:800],
+        })
+    return func_result
+
+
+def build_followup_prompt(func_result: list) -> str:
+    tool_output_text = json.dumps({"results": func_result}, ensure_ascii=False)
+    # Provide the model with the tool results but avoid naming the internal tool.
+    return (
+        SYSTEM_PROMPT
+        + "\n\n以下為檢索到的相關 PCR 文件（JSON 格式）：\n"
+        + tool_output_text
+        + "\n\n請根據上述文件結果，以中文向使用者回覆，並在回答中引用文件名稱與 PCR 登錄編號（不要提及內部工具或函式名稱）。\n\nAssistant:"
+    )
+
+
+def chat_response(reply: str, sid: str) -> ORJSONResponse:
+    """Serialize the { reply, session_id } body directly with orjson (skips jsonable_encoder)."""
+    return ORJSONResponse({"reply": reply, "session_id": sid})
+
+
+@router.post("/api/chat", response_class=ORJSONResponse)
 async def api_chat(body: ChatRequest):
     """
     Simple chat endpoint used by the front-end.
@@ -123,155 +369,152 @@ async def api_chat(body: ChatRequest):
     """
     try:
         # determine session id
-        sid = body.session_id
-        if not sid:
-            # create a simple session id (timestamp-based)
-            import time
-
-            sid = str(int(time.time() * 1000))
-
-        # ensure session exists
-        if sid not in SESSIONS:
-            SESSIONS[sid] = []
-
-        # append incoming messages to session store
-        for m in body.messages:
-            SESSIONS[sid].append({"role": m.role or "user", "content": m.content})
-
-        # build prompt from session history (last 40 messages to be safe)
-        parts = []
-        for m in SESSIONS[sid][-40:]:
-            role = m.get("role", "user")
-            parts.append(f"[{role}] {m.get('content', '')}")
-
-        # Prepend the server-side system instructions to ensure consistent assistant behavior
-        prompt_text = SYSTEM_PROMPT + "\n\n" + "\n".join(parts) + "\n\nAssistant:"
-
-        # Use google-genai function-calling if available
-        if genai is not None and types is not None:
-            model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-            api_key = os.getenv("GEMINI_API_KEY")
-            if api_key:
-                client = genai.Client(api_key=api_key)
-            else:
-                client = genai.Client()
-
-            # function declaration for the model
-            func_decl = {
-                "name": "pcr_chroma_search",
-                "description": "Search PCR records using Chroma vector index. Returns list of records with title, developer, regno and snippet.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "search": {"type": "string", "description": "search query"},
-                        "limit": {"type": "integer", "description": "max documents to return"},
-                    },
-                    "required": ["search"],
-                },
-            }
-
-            tool = types.Tool(function_declarations=[func_decl])
-            config = types.GenerateContentConfig(tools=[tool])
-
-            # Ask the model allowing it to call the declared function
-            response = client.models.generate_content(model=model, contents=prompt_text, config=config)
-
-            # Inspect candidates.content.parts thoroughly and log for debugging
-            func_call = None
-            try:
-                cands = getattr(response, "candidates", []) or []
-                logger.debug(f"genai returned {len(cands)} candidates")
-                # Iterate candidates and their parts to find function_call or text parts
-                for ci, cand in enumerate(cands):
-                    parts = getattr(cand.content, "parts", []) or []
-                    logger.debug(f"candidate[{ci}] has {len(parts)} parts")
-                    for pi, part in enumerate(parts):
-                        # Log available attributes for debugging
-                        text = getattr(part, "text", None)
-                        fc = getattr(part, "function_call", None)
-                        ts = getattr(part, "thought_signature", None)
-                        logger.info(f"candidate[{ci}].part[{pi}] text={bool(text)} func_call={bool(fc)} thought_signature={bool(ts)}")
-                        if text:
-                            logger.debug(f"part text (truncated): {str(text)[:400]}")
-                        if ts:
-                            logger.debug(f"thought_signature: {ts}")
-                        if fc:
-                            # found a function call; capture it and break
-                            func_call = fc
-                            logger.info(f"Found function_call in candidate[{ci}].part[{pi}]: name={getattr(fc,'name',None)}")
-                            break
-                    if func_call:
-                        break
-            except Exception as e:
-                logger.exception("Error while inspecting model response parts: %s", e)
-                func_call = None
-
-            # If the model invoked pcr_chroma_search via function_call, execute it
-            if func_call and getattr(func_call, "name", None) == "pcr_chroma_search":
-                raw_args = getattr(func_call, "args", "{}")
-                try:
-                    args = json.loads(raw_args) if isinstance(raw_args, str) else raw_args
-                except Exception:
-                    args = {}
+        sid = body.session_id or new_session_id()
 
-                search_text = str(args.get("search", "")).strip()
-                limit = int(args.get("limit", 3)) if args.get("limit") else 3
+        # load (or create) the session history
+        history = await load_session(sid)
 
-                # ensure chroma
-                if getattr(chroma_manager, "_db", None) is None:
-                    try:
-                        chroma_manager.initialize_db()
-                    except Exception as init_err:
-                        logger.error("初始化 ChromaDB 失敗: %s", init_err)
-                        SESSIONS[sid].append({"role": "assistant", "content": "(執行工具時發生錯誤，無法存取檔案索引)"})
-                        return {"reply": "無法存取檔案索引。請稍後再試。", "session_id": sid}
+        try:
+            # append incoming messages to session store
+            for m in body.messages:
+                history.append({"role": m.role or "user", "content": m.content})
 
-                db = get_chroma_db()
-                try:
-                    records = await get_pcr_records_from_chroma(db, skip=0, limit=limit, search=search_text)
-                except Exception as e:
-                    logger.exception("Chroma 檢索失敗: %s", e)
-                    SESSIONS[sid].append({"role": "assistant", "content": "(執行工具時發生錯誤)"})
-                    return {"reply": "檢索時發生錯誤。", "session_id": sid}
-
-                func_result = []
-                for r in records:
-                    func_result.append({
-                        "document_name": getattr(r, "document_name", ""),
-                        "developer": getattr(r, "developer", ""),
-                        "pcr_reg_no": getattr(r, "pcr_reg_no", ""),
-                        "snippet": (getattr(r, "page_content", "") or "")[:800],
-                    })
-
-                tool_output_text = json.dumps({"results": func_result}, ensure_ascii=False)
-                # Provide the model with the tool results but avoid naming the internal tool.
-                followup_prompt = (
-                    SYSTEM_PROMPT
-                    + "\n\n以下為檢索到的相關 PCR 文件（JSON 格式）：\n"
-                    + tool_output_text
-                    + "\n\n請根據上述文件結果，以中文向使用者回覆，並在回答中引用文件名稱與 PCR 登錄編號（不要提及內部工具或函式名稱）。\n\nAssistant:"
-                )
+            prompt_text = build_prompt_text(history)
 
-                final_resp = client.models.generate_content(model=model, contents=followup_prompt)
-                final_text = getattr(final_resp, "text", None) or str(final_resp)
-                final_text = sanitize_reply(final_text)
-                SESSIONS[sid].append({"role": "assistant", "content": final_text})
-                return {"reply": final_text, "session_id": sid}
+            # Use google-genai function-calling if available
+            if genai is not None and types is not None:
+                model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
-            # no function call -> treat as normal reply
-            reply_text = getattr(response, "text", None) or str(response)
-            reply_text = sanitize_reply(reply_text)
-            SESSIONS[sid].append({"role": "assistant", "content": reply_text})
-            return {"reply": reply_text, "session_id": sid}
+                # Identical prompts (re-asks, duplicate submits) are answered from the cache.
+                # Only plain replies are cached; answers grounded on tool results are always fresh.
+                cached_reply = await get_cached_llm_reply(model, prompt_text)
+                if cached_reply is not None:
+                    history.append({"role": "assistant", "content": cached_reply})
+                    return chat_response(cached_reply, sid)
+
+                # Ask the model allowing it to call the declared function
+                response = await generate_content(model, prompt_text, with_tools=True)
+                func_call = find_function_call(response)
+
+                # If the model invoked pcr_chroma_search via function_call, execute it
+                if func_call and getattr(func_call, "name", None) == "pcr_chroma_search":
+                    try:
+                        func_result = await run_pcr_search_tool(func_call)
+                    except PCRToolError as e:
+                        history.append({"role": "assistant", "content": e.history_note})
+                        return chat_response(e.reply, sid)
+
+                    final_resp = await generate_content(
+                        model, build_followup_prompt(func_result)
+                    )
+                    final_text = getattr(final_resp, "text", None) or str(final_resp)
+                    final_text = sanitize_reply(final_text)
+                    history.append({"role": "assistant", "content": final_text})
+                    return chat_response(final_text, sid)
+
+                # no function call -> treat as normal reply
+                reply_text = getattr(response, "text", None) or str(response)
+                reply_text = sanitize_reply(reply_text)
+                await set_cached_llm_reply(model, prompt_text, reply_text)
+                history.append({"role": "assistant", "content": reply_text})
+                return chat_response(reply_text, sid)
 
             # fallback when genai or types not available
-            reply_text = call_gemini_prompt(prompt_text)
+            reply_text = await call_gemini_prompt(prompt_text)
             reply_text = sanitize_reply(reply_text)
-            SESSIONS[sid].append({"role": "assistant", "content": reply_text})
-            print(SESSIONS[sid])
-            return {"reply": reply_text, "session_id": sid}
+            history.append({"role": "assistant", "content": reply_text})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("session=%s len=%d", sid, len(history))
+            return chat_response(reply_text, sid)
+        finally:
+            await save_session(sid, history)
     except RuntimeError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         logger.exception("Unexpected error in /api/chat")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@router.post("/api/chat/stream")
+async def api_chat_stream(body: ChatRequest):
+    """
+    Streaming variant of /api/chat using Server-Sent Events.
+    Accepts the same JSON as /api/chat and emits
+      data: {"delta": str}                      as the reply is generated,
+      data: {"done": true, "session_id": str}   once the reply is complete.
+    """
+    if genai is None or types is None:
+        raise HTTPException(
+            status_code=500,
+            detail="google-genai SDK is not installed. Please install it: `pip install google-genai`.",
+        )
+
+    sid = body.session_id or new_session_id()
+    history = await load_session(sid)
+    for m in body.messages:
+        history.append({"role": m.role or "user", "content": m.content})
+    prompt_text = build_prompt_text(history)
+
+    async def event_stream():
+        model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+        raw_parts = []
+        history_note = None
+        sanitizer = StreamSanitizer()
+        try:
+            client = get_genai_client()
+
+            # Ask the model allowing it to call the declared function; stop streaming
+            # as soon as it decides to call the tool instead of answering directly.
+            func_call = None
+            stream = await client.aio.models.generate_content_stream(
+                model=model, contents=prompt_text, config=get_genai_tool_config()
+            )
+            async for chunk in stream:
+                func_call = find_function_call(chunk)
+                if func_call:
+                    break
+                text = getattr(chunk, "text", None)
+                if text:
+                    raw_parts.append(text)
+                    delta = sanitizer.feed(text)
+                    if delta:
+                        yield _sse({"delta": delta})
+
+            if func_call and getattr(func_call, "name", None) == "pcr_chroma_search":
+                try:
+                    func_result = await run_pcr_search_tool(func_call)
+                except PCRToolError as e:
+                    history_note = e.history_note
+                    yield _sse({"delta": e.reply})
+                else:
+                    raw_parts = []
+                    stream = await client.aio.models.generate_content_stream(
+                        model=model, contents=build_followup_prompt(func_result)
+                    )
+                    async for chunk in stream:
+                        text = getattr(chunk, "text", None)
+                        if text:
+                            raw_parts.append(text)
+                            delta = sanitizer.feed(text)
+                            if delta:
+                                yield _sse({"delta": delta})
+
+            rest = sanitizer.flush()
+            if rest:
+                yield _sse({"delta": rest})
+            yield _sse({"done": True, "session_id": sid})
+        except Exception:
+            logger.exception("Unexpected error in /api/chat/stream")
+            yield _sse({"error": "Internal server error", "session_id": sid})
+        finally:
+            # persist the full reply once streaming has finished (or was interrupted)
+            reply_text = history_note or sanitize_reply("".join(raw_parts))
+            if reply_text:
+                history.append({"role": "assistant", "content": reply_text})
+            await save_session(sid, history)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -1,39 +1,70 @@
 import os
-import json
 import re
-from typing import Dict, List, Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # NOTE: 您需要安裝這些函式庫才能運行此腳本:
-# pip install chromadb pypdf tqdm langchain-community sentence-transformers
+# pip install chromadb pypdf tqdm langchain-community sentence-transformers orjson
 
 # --- 設定 ---
 PDF_FOLDER = "./pcr_pdfs"
 JSON_FILE = "pcr_list_scraped.json"
-CHROMA_DIR = "./chroma_db"  # 向量資料庫儲存路徑
-COLLECTION_NAME = "pcr_documents"
-# 這是您在 chroma_manager.py 中使用的模型，索引和檢索必須保持一致！
-MODEL_NAME = "paraphrase-multilingual-mpnet-base-v2"
+# 向量資料庫路徑、集合名稱與嵌入模型皆從 chroma_manager.py 匯入，索引和檢索必須保持一致！
 
 # --- 外部庫導入 ---
 try:
     # 這裡只導入 LangChain 的 Chroma Wrapper
     from langchain_community.vectorstores import Chroma
-    from langchain_community.embeddings import SentenceTransformerEmbeddings
+    import orjson
     from pypdf import PdfReader
     from tqdm import tqdm
+
+    from chroma_manager import (
+        CHROMA_PATH as CHROMA_DIR,
+        COLLECTION_NAME,
+        MODEL_NAME,
+        NORMALIZE_EMBEDDINGS,
+        check_index_compatibility,
+        get_embedder,
+        get_hnsw_collection_metadata,
+    )
 except ImportError:
     print(
-        "錯誤：請安裝必要的函式庫：pip install chromadb pypdf tqdm langchain-community sentence-transformers"
+        "錯誤：請安裝必要的函式庫：pip install chromadb pypdf tqdm langchain-community sentence-transformers orjson"
     )
     exit()
 
+# pypdfium2 (PDFium C++ 綁定) 擷取文字比 pypdf 快數倍；未安裝時退回使用 pypdf
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 # ----------------------------------------------------------------------
 # 【新增】為了解決 ChromaDB 的內部錯誤，設定一個安全的批次寫入大小。
 # 您的錯誤是 5461，我們設定一個更保守的值來確保寫入成功。
 MAX_CHROMA_BATCH_SIZE = 1000
+# 嵌入模型一次編碼的文本塊數量 (GPU 上越大越能提高利用率)
+EMBED_BATCH_SIZE = 64
+GPU_EMBED_BATCH_SIZE = 128  # GPU (fp16) 上使用較大的批次
 # ----------------------------------------------------------------------
 
+# 檔名開頭的 GUID (fid) 長度與驗證格式，只編譯一次
+GUID_LENGTH = 36
+_GUID_RE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+)
+
+# *** 使用更穩健的文本切割器 *** (無狀態，模組層級建立一次即可重複使用)
+TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=200,
+    separators=["\n\n", "\n", " ", ""],
+    length_function=len,
+    is_separator_regex=False,
+)
+
 
 def load_json_metadata(file_path: str) -> Dict[str, Any]:
     """
@@ -45,14 +76,15 @@ def load_json_metadata(file_path: str) -> Dict[str, Any]:
         print(f"錯誤：找不到檔案: {file_path}")
         return {}
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    # orjson 直接解析 bytes，比標準 json.load 快數倍
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read())
 
-    metadata_map = {}
-    for item in data:
-        fid = item.get("fid")
-        if fid and fid != "NoFID" and fid != "NoLink":
-            metadata_map[fid] = item
+    metadata_map = {
+        item["fid"]: item
+        for item in data
+        if item.get("fid") not in (None, "", "NoFID", "NoLink")
+    }
 
     print(f"成功載入 {len(metadata_map)} 筆 metadata (已使用 'fid' 欄位作為鍵)。")
     return metadata_map
@@ -61,22 +93,79 @@ def load_json_metadata(file_path: str) -> Dict[str, Any]:
 def extract_fid_from_filename(filename: str) -> str:
     """
     從 PDF 檔名 '{fid}-{name}.pdf' 中提取 fid。
-    fid 可能為純 GUID 或 GUID-YY-NNN 格式。
+    fid 為固定 36 字元的 GUID，位於檔名開頭，因此直接切片後再驗證格式。
     """
-    # 匹配檔名開頭的 GUID
-    guid_pattern = (
-        r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
-    )
+    head = filename[:GUID_LENGTH]
+    if _GUID_RE.match(head):
+        return head
 
-    # 匹配可能包含 -YY-NNN 後綴的 FID (例如: ...-23-015)
-    fid_pattern = rf"^({guid_pattern})"
+    return "NoFID"
 
-    match = re.search(fid_pattern, filename, re.IGNORECASE)
 
-    if match:
-        return match.group(1)
+def extract_pdf_text(file_path: str) -> str:
+    """讀取 PDF 所有頁面的文字，每頁以空行分隔。"""
+    page_texts = []
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    else:
+        reader = PdfReader(file_path)
+        page_texts = [page.extract_text() for page in reader.pages]
 
-    return "NoFID"
+    return "".join(text + "\n\n" for text in page_texts if text)
+
+
+def process_pdf(
+    filename: str, fid: str, metadata: Dict[str, Any]
+) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+    """
+    讀取單一 PDF 文件並分塊，回傳 (文本塊, metadata, ids) 三個列表。
+    此函數會在 ProcessPoolExecutor 的子行程中執行，因此必須定義在模組頂層。
+    """
+    file_path = os.path.join(PDF_FOLDER, filename)
+    documents: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    ids: List[str] = []
+
+    try:
+        # --- 讀取 PDF 內容並分塊 ---
+        text_content = extract_pdf_text(file_path)
+
+        if not text_content:
+            print(f"\n警告：文件 {filename} 內容為空或無法提取文本。跳過。")
+            return documents, metadatas, ids
+
+        chunks = TEXT_SPLITTER.split_text(text_content)
+        # 過濾掉可能因為邊緣情況產生的小塊
+        chunks = [chunk for chunk in chunks if len(chunk.strip()) > 50]
+
+        # --- 準備索引數據 ---
+        for i, chunk in enumerate(chunks):
+            # 複製 JSON 中的所有 metadata 到每個文本塊
+            documents.append(chunk)
+            metadatas.append(
+                {
+                    "fid": fid,
+                    "downloaded_filename": filename,
+                    "chunk_index": i,
+                    **metadata,  # 包含 JSON 中所有原始 metadata
+                }
+            )
+            ids.append(f"{fid}-{i}")  # 每個塊的唯一 ID
+
+    except Exception as e:
+        print(f"\n錯誤：處理文件 {filename} 時發生未預期的錯誤: {e}")
+        return [], [], []
+
+    return documents, metadatas, ids
 
 
 def index_pdfs_to_chroma():
@@ -89,6 +178,50 @@ def index_pdfs_to_chroma():
     if not metadata_map:
         return
 
+    # 2. 處理 PDF 文件
+    pdf_files = [f for f in os.listdir(PDF_FOLDER) if f.endswith(".pdf")]
+    print(f"找到 {len(pdf_files)} 個 PDF 文件準備索引...")
+
+    # 建立三個列表來儲存所有 PDF 文件分塊後的數據
+    documents = []
+    metadatas = []
+    ids = []
+    doc_count = 0
+
+    # 3. 從檔名中解析 FID (與 JSON 鍵一致)，只把有 metadata 的文件交給子行程處理
+    tasks = []
+    for filename in pdf_files:
+        fid = extract_fid_from_filename(filename)
+
+        if fid == "NoFID":
+            print(f"\n警告：檔名格式不符，無法提取 FID: {filename}")
+            continue
+
+        metadata = metadata_map.get(fid)
+        if not metadata:
+            print(f"\n警告：找不到 FID {fid} 的 JSON metadata。跳過文件：{filename}")
+            continue
+
+        tasks.append((filename, fid, metadata))
+
+    # 4. PDF 解析為 CPU 密集工作，以多行程平行處理；嵌入階段仍留在主行程 (獨佔 GPU)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        results = pool.map(
+            process_pdf,
+            [t[0] for t in tasks],
+            [t[1] for t in tasks],
+            [t[2] for t in tasks],
+            chunksize=4,
+        )
+        for docs, metas, chunk_ids in tqdm(
+            results, total=len(tasks), desc="讀取與分塊進度"
+        ):
+            documents.extend(docs)
+            metadatas.extend(metas)
+            ids.extend(chunk_ids)
+            doc_count += len(docs)
+
+    # 5. PDF 解析完成後才載入模型，避免子行程 fork 時繼承已初始化的 CUDA 狀態
     import torch
 
     # 決定使用的設備
@@ -99,105 +232,55 @@ def index_pdfs_to_chroma():
     else:
         print("未找到 GPU，將使用 CPU。")
     print(f"嵌入模型將在設備上運行: {device}")
-    # 2. 初始化嵌入模型 (與 chroma_manager.py 保持一致)
-    embeddings = SentenceTransformerEmbeddings(
-        model_name=MODEL_NAME,
-        model_kwargs={"device": device},  # 將 device 參數傳遞給底層模型
-    )
+    # 取得共用的嵌入模型 (與 chroma_manager.py 保持一致，同一 process 只載入一次)
+    embeddings = get_embedder(device)
     print(f"[{os.getpid()}] 正在使用嵌入模型: {MODEL_NAME}")
 
-    # 3. 初始化 Chroma 客戶端 (使用 LangChain Wrapper)
+    # 初始化 Chroma 客戶端 (使用 LangChain Wrapper)
     db = Chroma(
         collection_name=COLLECTION_NAME,
         embedding_function=embeddings,  # 傳入嵌入函數實例
         persist_directory=CHROMA_DIR,
+        collection_metadata=get_hnsw_collection_metadata(),  # HNSW 參數 (建立新集合時生效)
     )
     print(f"Chroma 客戶端已初始化，資料庫路徑: {CHROMA_DIR}")
 
-    # 4. 處理 PDF 文件
-    pdf_files = [f for f in os.listdir(PDF_FOLDER) if f.endswith(".pdf")]
-    print(f"找到 {len(pdf_files)} 個 PDF 文件準備索引...")
-
-    # 建立三個列表來儲存所有 PDF 文件分塊後的數據
-    documents = []
-    metadatas = []
-    ids = []
-    doc_count = 0
-
-    for filename in tqdm(pdf_files, desc="讀取與分塊進度"):
-        file_path = os.path.join(PDF_FOLDER, filename)
-
-        try:
-            # 5. 從檔名中解析 FID (與 JSON 鍵一致)
-            fid = extract_fid_from_filename(filename)
-
-            if fid == "NoFID":
-                print(f"\n警告：檔名格式不符，無法提取 FID: {filename}")
-                continue
-
-            metadata = metadata_map.get(fid)
-            if not metadata:
-                print(
-                    f"\n警告：找不到 FID {fid} 的 JSON metadata。跳過文件：{filename}"
-                )
-                continue
-
-            # --- 6. 讀取 PDF 內容並分塊 ---
-            reader = PdfReader(file_path)
-            text_content = ""
-            for i, page in enumerate(reader.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    text_content += page_text + "\n\n"
-
-            if not text_content:
-                print(f"\n警告：文件 {filename} 內容為空或無法提取文本。跳過。")
-                continue
-
-            # *** 使用更穩健的文本切割器 ***
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
-                separators=["\n\n", "\n", " ", ""],
-                length_function=len,
-                is_separator_regex=False,
-            )
-
-            chunks = text_splitter.split_text(text_content)
-            # 過濾掉可能因為邊緣情況產生的小塊
-            chunks = [chunk for chunk in chunks if len(chunk.strip()) > 50]
-
-            # --- 7. 準備索引數據 ---
-            for i, chunk in enumerate(chunks):
-                # 每個塊的唯一 ID
-                chunk_id = f"{fid}-{i}"
-
-                # 複製 JSON 中的所有 metadata 到每個文本塊
-                chunk_metadata = {
-                    "fid": fid,
-                    "downloaded_filename": filename,
-                    "chunk_index": i,
-                    **metadata,  # 包含 JSON 中所有原始 metadata
-                }
-
-                documents.append(chunk)
-                metadatas.append(chunk_metadata)
-                ids.append(chunk_id)
-                doc_count += 1
-
-        except Exception as e:
-            print(f"\n錯誤：處理文件 {filename} 時發生未預期的錯誤: {e}")
-            continue
+    # 既有索引的建立設定 (嵌入模型、正規化、距離空間) 與目前不同時中止，避免把兩種向量空間混寫在同一個集合中
+    if db._collection.count() > 0 and not check_index_compatibility(db._collection):
+        print(f"錯誤：既有索引與目前的嵌入設定不相容，請刪除 {CHROMA_DIR} 後重新執行本程式以重建索引。")
+        exit(1)
 
     # ------------------------------------------------------------------
-    # 【關鍵修改】8. 分批加入到 Chroma 集合中，避免觸發 Batch Size 限制
+    # 【關鍵修改】6. 分批加入到 Chroma 集合中，避免觸發 Batch Size 限制
     # ------------------------------------------------------------------
+    # 已存在於索引中的文本塊 (相同 {fid}-{i} ID) 不再重新嵌入，重複執行時只處理新增部分
+    existing_ids = set()
+    for i in range(0, len(ids), MAX_CHROMA_BATCH_SIZE):
+        existing_ids.update(
+            db._collection.get(ids=ids[i : i + MAX_CHROMA_BATCH_SIZE], include=[])["ids"]
+        )
+    if existing_ids:
+        print(f"\n索引中已存在 {len(existing_ids)} 個文本塊，將跳過。")
+        keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing_ids]
+        documents = [documents[i] for i in keep]
+        metadatas = [metadatas[i] for i in keep]
+        ids = [ids[i] for i in keep]
+
     total_chunks = len(documents)
     if total_chunks > 0:
         print(
             f"\n總共 {total_chunks} 個文本塊準備寫入 Chroma。將以 {MAX_CHROMA_BATCH_SIZE} 為批次進行..."
         )
 
+        # 先以大批次一次性計算所有文本塊的向量，避免 add_texts 逐批重新編碼
+        vectors = embeddings.client.encode(
+            documents,
+            batch_size=GPU_EMBED_BATCH_SIZE if device == "cuda" else EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=True,
+            normalize_embeddings=NORMALIZE_EMBEDDINGS,
+        )
+
         # 使用 tqdm 遍歷所有文本塊，每隔 MAX_CHROMA_BATCH_SIZE 取一個批次
         for i in tqdm(
             range(0, total_chunks, MAX_CHROMA_BATCH_SIZE), desc="寫入 Chroma DB 進度"
@@ -206,11 +289,16 @@ def index_pdfs_to_chroma():
             batch_docs = documents[i : i + MAX_CHROMA_BATCH_SIZE]
             batch_metadatas = metadatas[i : i + MAX_CHROMA_BATCH_SIZE]
             batch_ids = ids[i : i + MAX_CHROMA_BATCH_SIZE]
+            batch_vectors = vectors[i : i + MAX_CHROMA_BATCH_SIZE]
 
             try:
-                # 將批次數據寫入 Chroma
-                # LangChain's add_texts 會自動使用我們在步驟 3 傳入的 embeddings 函數進行嵌入。
-                db.add_texts(texts=batch_docs, metadatas=batch_metadatas, ids=batch_ids)
+                # 將批次數據連同預先計算的向量直接寫入底層 Chroma 集合
+                db._collection.add(
+                    ids=batch_ids,
+                    embeddings=batch_vectors.tolist(),
+                    documents=batch_docs,
+                    metadatas=batch_metadatas,
+                )
             except Exception as e:
                 # 如果某個批次寫入失敗，請輸出錯誤以便檢查
                 print(f"\n警告：批次 {i} 至 {i + len(batch_docs)} 寫入失敗: {e}")
@@ -223,7 +311,7 @@ def index_pdfs_to_chroma():
 
 
 if __name__ == "__main__":
-    # 在運行前，請確保刪除舊的 './chroma_db' 資料夾，以避免模型不一致的衝突。
+    # 若更換嵌入模型，請先刪除舊的 './chroma_db' 資料夾以避免模型不一致的衝突；否則重複執行只會加入新的文本塊。
     if not os.path.exists(PDF_FOLDER):
         print(f"錯誤：找不到 PDF 資料夾: {PDF_FOLDER}。請確認您的 PDF 文件已儲存。")
     else:
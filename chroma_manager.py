@@ -1,18 +1,119 @@
 import os
+import threading
+import time
+from functools import lru_cache
+from typing import List, Optional
+from cachetools import LRUCache
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import SentenceTransformerEmbeddings
 
 # --- 設定 ---
 
 
-MODEL_NAME = "paraphrase-multilingual-mpnet-base-v2"
+# 可由環境變數 EMBED_MODEL_NAME 換成較小、較快的模型 (例如 paraphrase-multilingual-MiniLM-L12-v2)；
+# 查詢與索引必須使用同一個模型，更換後需以 chroma_index_pdf.py 重建索引
+MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "paraphrase-multilingual-mpnet-base-v2")
+# 嵌入向量是否正規化 (索引與查詢必須一致；變更後需重建索引)
+NORMALIZE_EMBEDDINGS = True
 
 # CHROMA_PATH = "./chroma_json_store"
 
-CHROMA_PATH = "./chroma_db"  # 必須與 create_chroma_index.py 中的 CHROMA_DIR 一致
-COLLECTION_NAME = (
-    "pcr_documents"  # 必須與 create_chroma_index.py 中的 COLLECTION_NAME 一致
-)
+CHROMA_PATH = "./chroma_db"  # chroma_index_pdf.py 建立索引時也使用此路徑
+COLLECTION_NAME = "pcr_documents"  # chroma_index_pdf.py 建立索引時也使用此集合名稱
+
+# 查詢向量快取：相同的查詢文字不必重新執行一次模型前向傳播
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+_query_embedding_cache: LRUCache = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+_query_embedding_lock = threading.Lock()  # 查詢向量可能在多個執行緒中計算
+
+
+def get_hnsw_collection_metadata() -> dict:
+    """
+    Chroma 集合的 HNSW 索引參數 (建立集合時寫入，之後隨集合持久化)。
+    向量已正規化，因此使用 cosine 距離；search_ef 越大召回率越高、查詢越慢，可由 CHROMA_HNSW_SEARCH_EF 調整。
+    """
+    return {
+        "embed_model": MODEL_NAME,  # 記錄建立索引時使用的模型，載入時用來檢查是否一致
+        "embed_normalized": NORMALIZE_EMBEDDINGS,  # 記錄索引向量是否正規化，載入時用來檢查是否一致
+        "hnsw:space": "cosine",
+        "hnsw:M": 16,
+        "hnsw:construction_ef": 64,
+        "hnsw:search_ef": int(os.getenv("CHROMA_HNSW_SEARCH_EF", "100")),
+    }
+
+
+def check_index_compatibility(collection) -> bool:
+    """
+    比對集合 metadata 記錄的建立設定 (嵌入模型、向量是否正規化、距離空間) 與目前的查詢設定。
+    不一致 (或是舊版索引沒有記錄這些設定) 時印出警告並回傳 False：查詢向量與索引向量不一致時分數會偏移，需重建索引。
+    """
+    metadata = collection.metadata or {}
+    expected = get_hnsw_collection_metadata()
+    problems = []
+    for key, label in (
+        ("embed_model", "嵌入模型"),
+        ("embed_normalized", "向量正規化"),
+        ("hnsw:space", "距離空間"),
+    ):
+        # Chroma 未指定距離空間時預設為 l2
+        actual = metadata.get(key, "l2" if key == "hnsw:space" else None)
+        if actual != expected[key]:
+            problems.append(f"{label}: 索引為 {'未記錄' if actual is None else actual}，查詢使用 {expected[key]}")
+    if problems:
+        print(
+            f"[{os.getpid()}] 警告：向量索引 '{collection.name}' 的建立設定與目前的查詢設定不一致 "
+            f"({'；'.join(problems)})，檢索分數將不正確，請重建索引。"
+        )
+        return False
+    return True
+
+
+@lru_cache(maxsize=1)
+def get_embedder(device: Optional[str] = None) -> SentenceTransformerEmbeddings:
+    """
+    回傳共用的嵌入模型實例（每個 process 只載入一次）。
+    索引 (chroma_index_pdf.py) 與查詢 (ChromaDBManager) 共用同一個模型，避免重複載入權重。
+    device 為 None 時由 sentence-transformers 自動選擇 (有 GPU 時使用 cuda)，使用 GPU 時模型轉為 fp16。
+    在 CPU 上設定 EMBED_QUANTIZE_INT8=1 時，模型的 Linear 層會做 int8 動態量化 (較快、較省記憶體，向量會略有誤差)。
+    """
+    model_kwargs = {"device": device} if device else {}
+    print(f"[{os.getpid()}] 正在載入嵌入模型: {MODEL_NAME}")
+    embeddings = SentenceTransformerEmbeddings(
+        model_name=MODEL_NAME,
+        model_kwargs=model_kwargs,
+        # 索引與查詢向量皆正規化為單位向量，與 chroma_index_pdf.py 寫入的向量一致
+        encode_kwargs={"normalize_embeddings": NORMALIZE_EMBEDDINGS},
+    )
+    # 在 GPU 上以半精度 (fp16) 執行，推論速度約為 fp32 的數倍
+    if embeddings.client.device.type == "cuda":
+        embeddings.client.half()
+    elif os.getenv("EMBED_QUANTIZE_INT8") == "1":
+        import torch
+
+        transformer = embeddings.client[0]  # sentence-transformers 的 Transformer 模組
+        transformer.auto_model = torch.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        print(f"[{os.getpid()}] 嵌入模型已套用 int8 動態量化")
+    return embeddings
+
+
+def embed_queries(texts: List[str]) -> List[List[float]]:
+    """
+    回傳每個查詢文字的向量 (與 get_embedder().embed_query 相同)。
+    已計算過的文字直接取自 LRU 快取，其餘以一次 embed_documents 批次計算後寫入快取。
+    會執行模型推論，請在執行緒中呼叫以免阻塞事件迴圈。
+    """
+    with _query_embedding_lock:
+        vectors = {text: _query_embedding_cache.get(text) for text in texts}
+    missing = [text for text, vector in vectors.items() if vector is None]
+    if missing:
+        computed = get_embedder().embed_documents(missing)
+        vectors.update(zip(missing, computed))
+        with _query_embedding_lock:
+            for text, vector in zip(missing, computed):
+                _query_embedding_cache[text] = vector
+    return [vectors[text] for text in texts]
 
 
 class ChromaDBManager:
@@ -28,6 +129,7 @@ class ChromaDBManager:
         if cls._instance is None:
             cls._instance = super(ChromaDBManager, cls).__new__(cls)
             cls._instance._db = None
+            cls._instance.is_initialized = False  # initialize_db 成功後為 True
         return cls._instance
 
     def initialize_db(self):
@@ -36,7 +138,7 @@ class ChromaDBManager:
             print(f"[{os.getpid()}] 正在載入或初始化 ChromaDB...")
 
             # 使用與您的索引建立時相同的嵌入模型
-            embeddings = SentenceTransformerEmbeddings(model_name=MODEL_NAME)
+            embeddings = get_embedder()
 
             # 檢查 CHROMA_PATH 是否存在並包含數據
             if not os.path.exists(CHROMA_PATH):
@@ -50,8 +152,28 @@ class ChromaDBManager:
                 persist_directory=CHROMA_PATH,
                 embedding_function=embeddings,
                 collection_name=COLLECTION_NAME,  # 指定要從該資料夾中載入的集合
+                collection_metadata=get_hnsw_collection_metadata(),  # 僅在集合不存在時生效
             )
             print(f"[{os.getpid()}] ChromaDB 載入成功！集合名稱: {COLLECTION_NAME}")
+            self.is_initialized = True
+
+            check_index_compatibility(self._db._collection)
+
+    def warmup(self):
+        """
+        執行一次查詢，預先完成嵌入模型的第一次推論與 HNSW 索引載入，
+        避免第一個真正的請求承擔數秒的冷啟動延遲。
+        """
+        if self._db is None:
+            return
+        try:
+            start = time.perf_counter()
+            # 同一次查詢包含嵌入模型的前向傳播與 HNSW 檢索
+            self._db.similarity_search("warmup", k=1)
+            elapsed = time.perf_counter() - start
+            print(f"[{os.getpid()}] 嵌入模型與向量索引已預熱 (耗時 {elapsed:.2f} 秒)")
+        except Exception as e:
+            print(f"[{os.getpid()}] 預熱查詢失敗 (不影響服務): {e}")
 
     def get_db(self) -> Chroma:
         """提供存取 ChromaDB 實例的接口"""
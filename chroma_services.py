@@ -1,13 +1,21 @@
 from langchain.docstore.document import Document
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-import json
+from chroma_manager import (
+    MODEL_NAME,
+    check_index_compatibility,
+    get_embedder,
+    get_hnsw_collection_metadata,
+)
+import orjson
 import os
+import uuid
 
 # --- 設定 ---
 JSON_FILE = "pcr_list_scraped.json"
 CHROMA_PATH = "./chroma_json_store"
-MODEL_NAME = "paraphrase-multilingual-mpnet-base-v2"  # 適合中文的多語言嵌入模型
+# 嵌入模型 (MODEL_NAME) 與 PDF 索引共用 chroma_manager.get_embedder()，每個 process 只載入一次
+EMBED_BATCH_SIZE = 256  # 建立索引時一次編碼的文件數量
+MAX_CHROMA_BATCH_SIZE = 1000  # Chroma 單次寫入上限 (與 chroma_index_pdf.py 相同)
 
 # --- 數據處理函數 ---
 
@@ -16,8 +24,8 @@ def load_json_data(file_path: str) -> list:
     """從 JSON 檔案中讀取數據"""
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"找不到檔案: {file_path}。請確保檔案存在。")
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read())
     print(f"成功讀取 {len(data)} 個數據項目。")
     return data
 
@@ -45,7 +53,7 @@ def json_to_documents(data: List[Dict[str, Any]]) -> List[Document]:
 
         # 設置元數據 (metadata) - 儲存所有欄位
         # 即使內容欄位已合併，元數據中仍保留所有原始欄位，方便結果展示和過濾。
-        metadata = {k: v for k, v in item.items()}
+        metadata = dict(item)
 
         # 創建 Document
         doc = Document(page_content=content, metadata=metadata)
@@ -69,14 +77,18 @@ def json_to_documents(data: List[Dict[str, Any]]) -> List[Document]:
 def setup_db():
 
     # --- 步驟 2: 建立或載入嵌入模型和向量儲存 ---
-    embeddings = SentenceTransformerEmbeddings(model_name=MODEL_NAME)
-
-    if (
-        not os.path.exists(CHROMA_PATH)
-        or not Chroma(
-            persist_directory=CHROMA_PATH, embedding_function=embeddings
-        ).get()["ids"]
-    ):
+    embeddings = get_embedder()
+    print(f"使用嵌入模型: {MODEL_NAME}")
+
+    # 只開啟一次向量儲存；以 count() 判斷是否為空 (不像 get() 會讀出所有 id)
+    # 向量在寫入時已正規化，集合使用 cosine 空間的 HNSW 參數 (與 PDF 索引相同；僅在建立集合時生效)
+    db = Chroma(
+        persist_directory=CHROMA_PATH,
+        embedding_function=embeddings,
+        collection_metadata=get_hnsw_collection_metadata(),
+    )
+
+    if db._collection.count() == 0:
         print(">>> 建立新的向量索引...")
         # 第一次運行：存入 ChromaDB
         try:
@@ -87,9 +99,28 @@ def setup_db():
             print(f"錯誤：{e}")
             raise Exception("無法繼續，因為缺少必要的數據檔案。")
 
-        db = Chroma.from_documents(documents, embeddings, persist_directory=CHROMA_PATH)
+        # 一次以大批次計算所有文件的向量 (sentence-transformers 內部會依長度排序以減少 padding)，
+        # 再連同向量直接寫入集合，避免 from_documents 逐批重新編碼
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        vectors = embeddings.client.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=True,
+            **embeddings.encode_kwargs,
+        )
+
+        for i in range(0, len(texts), MAX_CHROMA_BATCH_SIZE):
+            batch_texts = texts[i : i + MAX_CHROMA_BATCH_SIZE]
+            db._collection.add(
+                ids=[str(uuid.uuid4()) for _ in batch_texts],
+                embeddings=vectors[i : i + MAX_CHROMA_BATCH_SIZE].tolist(),
+                documents=batch_texts,
+                metadatas=metadatas[i : i + MAX_CHROMA_BATCH_SIZE],
+            )
     else:
+        # 後續運行：直接使用已載入的索引 (建立設定與目前的查詢設定不同時會印出警告)
         print(">>> 載入已存在的向量索引...")
-        # 後續運行：直接載入
-        db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embeddings)
+        check_index_compatibility(db._collection)
     return db
@@ -1,5 +1,7 @@
 import sqlite3
 import logging
+import threading
+from typing import Optional
 from fastapi import HTTPException
 
 # 配置日誌
@@ -8,17 +10,60 @@ logger = logging.getLogger(__name__)
 # 資料庫檔案名稱
 DATABASE_FILE = "pcr_list.db"
 
+# pcr_records 的 FTS5 全文索引 (trigram 分詞可對中文做子字串比對，查詢至少需 3 個字)；
+# 由 sqlite_saver.py 寫入資料時建立並重建，伺服器只讀取 (名稱須與 sqlite_saver.py 的 FTS_TABLE 相同)
+FTS_TABLE = "pcr_fts"
+FTS_MIN_QUERY_LENGTH = 3
+_fts_lock = threading.Lock()
+_fts_ready: Optional[bool] = None  # None: 尚未檢查；False: 資料庫中沒有可用的 FTS 索引
+
+# 每個執行緒重複使用同一條連線，避免每次請求都重新開啟資料庫與設定 PRAGMA
+_local = threading.local()
+
+
+def _open_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DATABASE_FILE)
+    conn.row_factory = sqlite3.Row  # 讓查詢結果可以像字典一樣存取
+    # 伺服器只讀取資料庫，不變更檔案的日誌模式 (WAL 由 sqlite_saver.py 寫入時設定)；以下 PRAGMA 只影響此連線
+    conn.execute("PRAGMA mmap_size=268435456")  # 以 mmap 讀取資料庫檔案 (256 MB)
+    conn.execute("PRAGMA cache_size=-65536")  # 頁面快取 64 MB
+    return conn
+
 
 def get_db_connection():
     """
-    建立並返回一個 SQLite 資料庫連線。
+    返回目前執行緒共用的 SQLite 資料庫連線 (第一次呼叫時建立)。
     連線會設定為 row_factory，讓查詢結果可以像字典一樣存取。
+    連線由模組管理並重複使用，呼叫端不需要 (也不應該) 關閉它。
     """
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        conn.row_factory = sqlite3.Row  # 讓查詢結果可以像字典一樣存取
+        conn = getattr(_local, "conn", None)
+        if conn is None:
+            conn = _local.conn = _open_connection()
         return conn
     except sqlite3.Error as e:
         logger.error(f"無法連接到資料庫 '{DATABASE_FILE}': {e}")
         # 在 FastAPI 應用程式中拋出 HTTPException
         raise HTTPException(status_code=500, detail="無法連接到資料庫")
+
+
+def fts_index_available() -> bool:
+    """
+    回傳 pcr_records 的 FTS5 全文索引是否可用 (每個 process 只檢查一次，不寫入資料庫)。
+    索引由 sqlite_saver.py 建立並在每次寫入後重建；資料庫中沒有索引，
+    或此 SQLite 無法讀取 (未編譯 FTS5 或 trigram 分詞器) 時回傳 False，查詢改用 LIKE。
+    """
+    global _fts_ready
+    if _fts_ready is not None:
+        return _fts_ready
+    with _fts_lock:
+        if _fts_ready is None:
+            conn = get_db_connection()
+            try:
+                conn.execute(f"SELECT rowid FROM {FTS_TABLE} LIMIT 1").fetchall()
+                _fts_ready = True
+                logger.info("已找到 FTS5 全文索引。")
+            except sqlite3.Error as e:
+                logger.warning("無法使用 FTS5 全文索引 (請執行 sqlite_saver.py 建立)，改用 LIKE 查詢: %s", e)
+                _fts_ready = False
+    return _fts_ready
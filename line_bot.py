@@ -1,28 +1,21 @@
 from fastapi import APIRouter, Request, Header, HTTPException
-from langchain_community.chat_models import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import (
-    ChatPromptTemplate,
-    MessagesPlaceholder,
-)  # 引入 ChatPromptTemplate
-from langchain.agents import (
-    AgentExecutor,
-    create_openai_tools_agent,
-)  # 引入 Agent 相關模組
+from openai import AsyncOpenAI
+from cachetools import TTLCache
+from collections import deque
 from dotenv import load_dotenv
+import asyncio
 import logging
-from typing import Optional
+import orjson
+import os
+import weakref
+from typing import Optional, Tuple
 
 # 從 line_helpers.py 引入相關函數和變數
 from line_helpers import reply_line, LINE_CHANNEL_ACCESS_TOKEN
 
 # 從 tools.py 匯入定義的工具
-from tools import pcr_database_search  # 匯入 pcr_database_search 工具
+from tools import normalize_query, pcr_database_search  # 匯入 pcr_database_search 工具與查詢正規化
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 # 加載環境變量
@@ -42,26 +35,79 @@ router = APIRouter(
     tags=["LINE Bot"],  # 在 Swagger UI 中分組
 )
 
-llm = ChatOpenAI(temperature=0, model="gpt-4")
+# 可由環境變數 OPENAI_MODEL 換成較便宜、較快的模型 (例如 gpt-4o-mini)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+# 工具呼叫的最大輪數，避免模型反覆呼叫工具造成無窮迴圈
+MAX_TOOL_ROUNDS = 3
+# 每個用戶保留的對話訊息上限
+MAX_HISTORY_MESSAGES = 40
+
+_openai_client = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """回傳共用的 AsyncOpenAI 客戶端 (第一次使用時建立，重複使用連線池)。"""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI()
+    return _openai_client
+
+
+# 儲存每個用戶的對話歷史 {user_id: deque[{"role": ..., "content": ...}]}
+# 以 LRU + TTL 限制數量，閒置超過一小時的對話自動淘汰，避免記憶體無限成長
+user_sessions: TTLCache = TTLCache(maxsize=10000, ttl=3600)
+# 每個用戶一把鎖：同一用戶的訊息依序處理 (對話記憶不會交錯)，不同用戶則並行處理
+# 以 WeakValueDictionary 保存：持有或等待鎖的事件仍在處理時鎖不會被淘汰，沒有人使用時自動釋放
+user_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+    weakref.WeakValueDictionary()
+)
+
+# 首輪對話 (尚無歷史) 的 Agent 回覆快取，以正規化後的查詢為鍵；修改 Prompt 時請遞增版本號使舊快取失效
+AGENT_PROMPT_VERSION = 1
+first_turn_reply_cache: TTLCache = TTLCache(maxsize=10000, ttl=1800)
+
+
+# 背景處理中的事件任務 (保留參照，避免任務在完成前被垃圾回收)
+_background_tasks: set = set()
+
+
+def _on_background_task_done(task: asyncio.Task) -> None:
+    """移除已完成的事件任務，並記錄任務中未處理的例外 (否則會被靜默忽略)。"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("處理 LINE 事件失敗", exc_info=task.exception())
 
-# 儲存每個用戶的對話記憶和 Agent 執行器
-user_sessions = (
-    {}
-)  # 儲存 {user_id: {"memory": ConversationBufferMemory, "agent_executor": AgentExecutor}}
 
 # 下載連結的基礎 URL，與前端介面保持一致
 DOWNLOAD_BASE_URL = "https://cfp-calculate.tw/cfpc/Carbon/WebPage/"
 
-# 定義 Agent 可以使用的工具列表
-tools = [pcr_database_search]
+# Agent 可以使用的工具：名稱對應實際執行的 LangChain tool
+TOOLS = {pcr_database_search.name: pcr_database_search}
 
-# 定義 Agent 的 Prompt
+# OpenAI tools API 的工具定義 (只建立一次)
+OPENAI_TOOL_SCHEMAS = [
+    {
+        "type": "function",
+        "function": {
+            "name": pcr_database_search.name,
+            "description": pcr_database_search.description,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "用戶提供的產品名稱、CCC Code 或其他相關搜尋關鍵字。",
+                    }
+                },
+                "required": ["query"],
+            },
+        },
+    }
+]
+
+# 定義 Agent 的系統提示
 # 這個 Prompt 將引導 LLM 如何思考和使用工具
-agent_prompt_template = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """你是一位專業的 AI 永續顧問，專門協助用戶查詢產品的 PCR (產品類別規則) 資料。
+SYSTEM_PROMPT = """你是一位專業的 AI 永續顧問，專門協助用戶查詢產品的 PCR (產品類別規則) 資料。
 你的目標是根據用戶的查詢，利用提供的工具查找相關 PCR 資訊，並以專業、清晰、自然的語氣回覆用戶。
 
 請嚴格遵守以下對話策略：
@@ -86,15 +132,121 @@ agent_prompt_template = ChatPromptTemplate.from_messages(
         * 告知用戶系統發生錯誤，請稍後再試。
 
 請始終保持專業、樂於助人且自然的對話風格。
-""",
-        ),
-        MessagesPlaceholder(variable_name="chat_history"),  # 引入對話歷史
-        ("user", "{input}"),  # 用戶的當前輸入
-        MessagesPlaceholder(
-            variable_name="agent_scratchpad"
-        ),  # Agent 內部思考和工具呼叫的痕跡
-    ]
-)
+"""
+
+
+def get_user_lock(user_id: str) -> asyncio.Lock:
+    """取得 (或建立) 該用戶的對話鎖。"""
+    lock = user_locks.get(user_id)
+    if lock is None:
+        lock = user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+async def handle_event(event: dict):
+    """處理單一 LINE 事件。"""
+    logger.info(f"處理事件: {event.get('type')}")
+    if event.get("type") == "message" and event["message"].get("type") == "text":
+        user_message = event["message"]["text"].strip()
+        reply_token = event["replyToken"]
+        user_id = event["source"]["userId"]
+
+        logger.info(f"收到用戶 '{user_id}' 的訊息: '{user_message}'")
+
+        # 同一用戶的訊息依序處理，確保對話歷史順序正確
+        async with get_user_lock(user_id):
+            # 獲取或初始化用戶的對話歷史
+            history = user_sessions.get(user_id)
+            if history is None:
+                history = deque(maxlen=MAX_HISTORY_MESSAGES)
+            # 每次互動重新寫入以刷新 TTL
+            user_sessions[user_id] = history
+
+            logger.info(f"用戶 '{user_id}' 正在與 Agent 互動。")
+
+            # 只有在沒有對話歷史時，相同查詢的回覆才必然相同，可直接使用快取
+            cache_key = None
+            if not history:
+                cache_key = (normalize_query(user_message), AGENT_PROMPT_VERSION)
+
+            cached_reply = first_turn_reply_cache.get(cache_key) if cache_key else None
+            if cached_reply is not None:
+                logger.info(f"使用快取的 Agent 回覆 (用戶 '{user_id}')")
+                bot_reply_message = cached_reply
+                history.append({"role": "user", "content": user_message})
+                history.append({"role": "assistant", "content": bot_reply_message})
+            else:
+                bot_reply_message, ok = await run_agent(history, user_message)
+                if ok and cache_key:
+                    first_turn_reply_cache[cache_key] = bot_reply_message
+
+        await reply_line(reply_token, [{"type": "text", "text": bot_reply_message}])
+    else:
+        logger.info(f"收到非文本訊息或非訊息事件，類型: {event.get('type')}")
+
+
+async def run_tool_call(tool_call) -> str:
+    """執行模型要求的工具呼叫，回傳給模型的 JSON 字串。"""
+    tool = TOOLS.get(tool_call.function.name)
+    if tool is None:
+        return orjson.dumps({"error": f"未知的工具: {tool_call.function.name}"}).decode()
+    try:
+        args = orjson.loads(tool_call.function.arguments or "{}")
+        # 工具已回傳可直接序列化的 dict 列表
+        records = await tool.ainvoke(args)
+        return orjson.dumps(records).decode()
+    except Exception as e:
+        logger.error(f"工具 {tool_call.function.name} 執行失敗: {e}")
+        return orjson.dumps({"error": "工具執行失敗"}).decode()
+
+
+async def run_agent(history: deque, user_message: str) -> Tuple[str, bool]:
+    """
+    以 OpenAI tools API 產生回覆 (必要時先執行工具)，並將本輪對話寫入歷史。
+    回傳 (回覆內容, 是否成功)；失敗時回覆為錯誤提示，不應被快取。
+    """
+    # 將用戶訊息加入歷史 (在 Agent 處理前)
+    history.append({"role": "user", "content": user_message})
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}, *history]
+
+    try:
+        for _ in range(MAX_TOOL_ROUNDS + 1):
+            response = await get_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                temperature=0,
+                messages=messages,
+                tools=OPENAI_TOOL_SCHEMAS,
+                tool_choice="auto",
+            )
+            message = response.choices[0].message
+            if not message.tool_calls:
+                break
+
+            # 模型要求呼叫工具：執行後把結果附加到訊息中，再請模型產生回覆
+            messages.append(message.model_dump(exclude_none=True))
+            results = await asyncio.gather(
+                *(run_tool_call(tool_call) for tool_call in message.tool_calls)
+            )
+            for tool_call, result in zip(message.tool_calls, results):
+                messages.append(
+                    {"role": "tool", "tool_call_id": tool_call.id, "content": result}
+                )
+        else:
+            raise RuntimeError(f"工具呼叫超過 {MAX_TOOL_ROUNDS} 輪")
+
+        bot_reply_message = message.content or ""
+        logger.info(f"Agent 回覆: {bot_reply_message}")
+
+        # 將 Agent 的回覆加入歷史 (在 Agent 處理後)
+        history.append({"role": "assistant", "content": bot_reply_message})
+        return bot_reply_message, True
+
+    except Exception as e:
+        logger.error(f"Agent 執行失敗: {e}")
+        bot_reply_message = "抱歉，AI 服務目前無法回應，請稍後再試。"
+        # 即使 Agent 失敗，也要將錯誤回覆加入歷史，保持對話連貫性
+        history.append({"role": "assistant", "content": bot_reply_message})
+        return bot_reply_message, False
 
 
 @router.post("/webhook")
@@ -104,7 +256,7 @@ async def line_webhook(request: Request, x_line_signature: str = Header(None)):
     """
     logger.info("收到 LINE Webhook 請求。")
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
         logger.info(f"Webhook 請求體: {body}")
     except Exception as e:
         logger.error(f"解析 Webhook 請求體失敗: {e}")
@@ -115,67 +267,11 @@ async def line_webhook(request: Request, x_line_signature: str = Header(None)):
         logger.warning("Webhook 請求體中沒有事件。")
         return "OK"
 
+    # 立即回應 200 給 LINE (逾時會觸發重送)，事件改在背景處理，完成後以 reply token 回覆
+    # 同一個 Webhook 可能包含多個事件，並行處理以免彼此等待 LLM 回應
     for event in events:
-        logger.info(f"處理事件: {event.get('type')}")
-        if event.get("type") == "message" and event["message"].get("type") == "text":
-            user_message = event["message"]["text"].strip()
-            reply_token = event["replyToken"]
-            user_id = event["source"]["userId"]
-
-            logger.info(f"收到用戶 '{user_id}' 的訊息: '{user_message}'")
-
-            # 獲取或初始化用戶的會話記憶和 Agent 執行器
-            if user_id not in user_sessions:
-                memory = ConversationBufferMemory(
-                    memory_key="chat_history", return_messages=True
-                )
-                # 創建 Agent
-                agent = create_openai_tools_agent(llm, tools, agent_prompt_template)
-                # 創建 Agent 執行器
-                agent_executor = AgentExecutor(
-                    agent=agent,
-                    tools=tools,
-                    verbose=True,  # 設置為 True 可以看到 Agent 的思考過程，有利於調試
-                    handle_parsing_errors=True,  # 處理 Agent 輸出解析錯誤
-                )
-                user_sessions[user_id] = {
-                    "memory": memory,
-                    "agent_executor": agent_executor,
-                }
-
-            session = user_sessions[user_id]
-            memory = session["memory"]
-            agent_executor = session["agent_executor"]
-
-            logger.info(f"用戶 '{user_id}' 正在與 Agent 互動。")
-
-            try:
-                # 將用戶訊息加入記憶體 (在 Agent 處理前)
-                memory.chat_memory.add_user_message(user_message)
-
-                # 呼叫 Agent 執行器
-                # Agent 會根據用戶輸入和對話歷史，決定是否使用工具，然後生成回應
-                agent_response = await agent_executor.ainvoke(
-                    {
-                        "input": user_message,
-                        "chat_history": memory.chat_memory.messages,  # 傳遞對話歷史
-                    }
-                )
-
-                bot_reply_message = agent_response["output"]
-                logger.info(f"Agent 回覆: {bot_reply_message}")
-
-                # 將 Agent 的回覆加入記憶體 (在 Agent 處理後)
-                memory.chat_memory.add_ai_message(bot_reply_message)
-
-            except Exception as e:
-                logger.error(f"Agent 執行失敗: {e}")
-                bot_reply_message = "抱歉，AI 服務目前無法回應，請稍後再試。"
-                # 即使 Agent 失敗，也要將錯誤回覆加入記憶體，保持對話連貫性
-                memory.chat_memory.add_ai_message(bot_reply_message)
-
-            await reply_line(reply_token, [{"type": "text", "text": bot_reply_message}])
-        else:
-            logger.info(f"收到非文本訊息或非訊息事件，類型: {event.get('type')}")
+        task = asyncio.create_task(handle_event(event))
+        _background_tasks.add(task)
+        task.add_done_callback(_on_background_task_done)
 
     return "OK"
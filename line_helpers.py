@@ -1,6 +1,7 @@
 # line_helpers.py (這是概念上的獨立檔案)
 import os
 import httpx
+import orjson
 import logging
 from dotenv import load_dotenv
 # 加載環境變量
@@ -17,6 +18,35 @@ if not LINE_CHANNEL_ACCESS_TOKEN:
     # 在實際部署中，您可能需要在此處退出或拋出異常
     # raise ValueError("LINE_CHANNEL_ACCESS_TOKEN is not set.")
 
+LINE_REPLY_URL = "https://api.line.me/v2/bot/message/reply"
+
+# 共用的 HTTP 客戶端 (連線池 + keep-alive)，避免每次回覆都重新進行 TCP/TLS 握手
+_line_client = None
+
+
+def get_line_client() -> httpx.AsyncClient:
+    """回傳共用的 httpx.AsyncClient，第一次使用時才建立。"""
+    global _line_client
+    if _line_client is None:
+        _line_client = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+            headers={
+                "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
+                "Content-Type": "application/json",
+            },
+        )
+    return _line_client
+
+
+async def close_line_client():
+    """關閉共用的 HTTP 客戶端 (於應用程式關閉時呼叫)。"""
+    global _line_client
+    if _line_client is not None:
+        await _line_client.aclose()
+        _line_client = None
+
+
 async def reply_line(reply_token: str, messages: list):
     """
     發送訊息到 LINE 回覆 API。
@@ -28,31 +58,22 @@ async def reply_line(reply_token: str, messages: list):
         logger.error("無法回覆 LINE：LINE_CHANNEL_ACCESS_TOKEN 未設置。")
         return
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-    }
     data = {"replyToken": reply_token, "messages": messages}
     
     logger.info(f"準備向 LINE API 發送回覆。reply_token: {reply_token[:10]}...")
     logger.debug(f"發送數據: {data}")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                "https://api.line.me/v2/bot/message/reply",
-                headers=headers,
-                json=data,
-                timeout=10
-            )
-            response.raise_for_status()
-            logger.info(f"LINE API 回覆成功，狀態碼: {response.status_code}")
-            logger.debug(f"LINE API 回應內容: {response.text}")
-        except httpx.TimeoutException:
-            logger.error("回覆 LINE API 超時。")
-        except httpx.RequestError as e:
-            logger.error(f"回覆 LINE API 請求錯誤: {e}")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"回覆 LINE API 失敗，HTTP 狀態碼: {e.response.status_code} - {e.response.text}")
-        except Exception as e:
-            logger.error(f"回覆 LINE 發生未知錯誤: {e}")
+    try:
+        # 以 orjson 序列化請求內容 (Content-Type 已設定在共用客戶端的標頭)
+        response = await get_line_client().post(LINE_REPLY_URL, content=orjson.dumps(data))
+        response.raise_for_status()
+        logger.info(f"LINE API 回覆成功，狀態碼: {response.status_code}")
+        logger.debug(f"LINE API 回應內容: {response.text}")
+    except httpx.TimeoutException:
+        logger.error("回覆 LINE API 超時。")
+    except httpx.RequestError as e:
+        logger.error(f"回覆 LINE API 請求錯誤: {e}")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"回覆 LINE API 失敗，HTTP 狀態碼: {e.response.status_code} - {e.response.text}")
+    except Exception as e:
+        logger.error(f"回覆 LINE 發生未知錯誤: {e}")
@@ -1,14 +1,24 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+import logging
 import os
+from dotenv import load_dotenv
+
+# 先載入 .env，讓下列模組在匯入時讀到的環境變數 (例如 EMBED_MODEL_NAME) 生效
+load_dotenv()
+
+# 根日誌設定由應用程式進入點統一負責 (各路由模組只取得自己的 logger)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
 from chroma_manager import chroma_manager, ChromaDBManager
 from pcr_router import router as pcr_records_router
 from chat_router import router as chat_router
-from dotenv import load_dotenv
-load_dotenv()
+from line_helpers import close_line_client
 
 # from line_bot import router as line_bot_router
 
@@ -19,19 +29,29 @@ async def lifespan(app: FastAPI):
     # 啟動時：載入 ChromaDB
     try:
         chroma_manager.initialize_db()
+        # 預熱：先跑一次查詢，讓第一個請求不必承擔模型與索引的冷啟動
+        chroma_manager.warmup()
     except FileNotFoundError as e:
         print(f"嚴重錯誤: {e}")
         # 在實際生產中，您可能需要更優雅的錯誤處理或直接退出
 
     yield
 
+    # 關閉 LINE 回覆 API 共用的 HTTP 連線池
+    await close_line_client()
+
     # 關閉時：執行清理工作（本地 ChromaDB 通常不需要，但為了標準化保留）
     print(f"[{os.getpid()}] 應用程式關閉，執行清理...")
     pass
 
 
 # 初始化 FastAPI 應用程式
-app = FastAPI(lifespan=lifespan, title="RAG 語義搜尋服務")
+# 預設以 orjson 序列化 JSON 回應
+app = FastAPI(
+    lifespan=lifespan,
+    title="RAG 語義搜尋服務",
+    default_response_class=ORJSONResponse,
+)
 
 
 # 包含 PCR 記錄的路由
@@ -1,6 +1,7 @@
 import os
-import json
+import orjson
 import re
+import sys
 from typing import Dict, List, Any
 
 # --- 設定 ---
@@ -16,8 +17,8 @@ def get_names():
 
     try:
         # 1. 載入數據
-        with open(JSON_FILE, "r", encoding="utf-8") as f:
-            data: List[Dict[str, Any]] = json.load(f)
+        with open(JSON_FILE, "rb") as f:
+            data: List[Dict[str, Any]] = orjson.loads(f.read())
 
         print(f"成功載入 {len(data)} 筆數據。開始處理...")
 
@@ -29,9 +30,10 @@ def get_names():
 
         print(f"已取得 {len(document_names)} 個 document_name。")
 
-        for name in document_names:
-            print(name)
-    except json.JSONDecodeError:
+        # 一次寫出所有名稱，避免逐筆 print
+        if document_names:
+            sys.stdout.write("\n".join(document_names) + "\n")
+    except orjson.JSONDecodeError:
         print(f"錯誤：檔案 {JSON_FILE} 不是有效的 JSON 格式。")
     except Exception as e:
         print(f"處理檔案時發生未預期的錯誤: {e}")
@@ -1,8 +1,12 @@
 import os
 import json
 import requests
-from typing import List, Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Set, Tuple
 import re
+import sys
 
 # 由於 urllib.parse 才是真正需要的，我們明確引入
 import urllib.parse
@@ -14,6 +18,22 @@ PDF_FOLDER = "./pcr_pdfs"  # PDF 文件儲存資料夾
 # 您提供的下載連結基礎 URL
 DOWNLOAD_BASE_URL = "https://cfp-calculate.tw/cfpc/Carbon/WebPage/"
 
+# 預先編譯的正規表示式 (避免每筆下載都重新查詢 re 的快取)
+_FID_RE = re.compile(r"fid=([^&]+)")
+_FILENAME_RE = re.compile(r'filename\*?=(?:utf-8\'\'|")?([^;"]+)', re.I)
+_UNSAFE_FILENAME_RE = re.compile(r'[\\/:*?"<>|]')
+_PDF_EXT = ".pdf"
+
+# 並行下載的執行緒數量；連線池大小與其相同，讓每條執行緒各用一條 keep-alive 連線
+DOWNLOAD_WORKERS = 8
+HTTP_POOL_MAXSIZE = DOWNLOAD_WORKERS
+# 下載寫檔的區塊大小 (1 MiB)：8 KiB 區塊會讓多 MB 的 PDF 產生上百次 Python 呼叫與 write 系統呼叫
+WRITE_CHUNK_SIZE = 1024 * 1024
+# fid 為 36 字元的 GUID，已下載的檔名格式為 "{fid}-{原始文件名}"
+FID_LENGTH = 36
+# 下載進度訊息每累積幾筆輸出一次
+PROGRESS_FLUSH_EVERY = 10
+
 
 # --- 輔助函數：載入 JSON 數據 ---
 def load_json_data(file_path: str) -> List[Dict[str, Any]]:
@@ -29,7 +49,7 @@ def load_json_data(file_path: str) -> List[Dict[str, Any]]:
 def extract_fid_from_link(link: str) -> str:
     """從 download_link 欄位中提取 fid"""
     # 確保 fid 參數可以被正確提取
-    match = re.search(r"fid=([^&]+)", link)
+    match = _FID_RE.search(link)
     return match.group(1) if match else "NoFID"
 
 
@@ -43,10 +63,19 @@ def get_filename_from_response(response: requests.Response) -> str:
     # 預設文件名（如果找不到任何標頭信息）
     filename = "downloaded_file.pdf"
 
+    # 快速路徑：純 ASCII、只有 filename=（沒有 RFC 5987 的 filename*）且沒有引號時，
+    # 直接以正規表示式取值，省去建立 email.message 與編碼修正；
+    # 有引號時值可能包含 ; 或跳脫字元，交由 email.message 解析以免兩條路徑結果不同
+    fast_match = None
+    if cd and cd.isascii() and '"' not in cd and "filename*" not in cd.lower():
+        fast_match = _FILENAME_RE.search(cd)
+
     if not cd:
         # 如果 Content-Disposition 標頭不存在，嘗試從 URL 結尾獲取文件名
         url_path = urllib.parse.urlparse(response.url).path
         filename = os.path.basename(url_path) or filename
+    elif fast_match:
+        filename = urllib.parse.unquote(fast_match.group(1).strip())
     else:
         parsed_filename = None
         try:
@@ -68,7 +97,7 @@ def get_filename_from_response(response: requests.Response) -> str:
         # 僅在 email.message 沒有得到有效文件名時執行
         if not parsed_filename:
             # 匹配 filename 或 filename*
-            match = re.search(r'filename\*?=(?:utf-8\'\'|")?([^;"]+)', cd, re.I)
+            match = _FILENAME_RE.search(cd)
             if match:
                 raw_value = match.group(1).strip("'\"")
 
@@ -87,17 +116,111 @@ def get_filename_from_response(response: requests.Response) -> str:
                     filename = decoded_value
 
     # 確保文件名以 .pdf 結尾（如果伺服器回傳的文件名沒有擴展名）
-    if not filename.lower().endswith(".pdf"):
-        filename += ".pdf"
+    if not filename.lower().endswith(_PDF_EXT):
+        filename += _PDF_EXT
 
     # 清理文件名中的非法字符 (避免操作系統錯誤)
     # 刪除所有不允許的字符
-    safe_filename = re.sub(r'[\\/:*?"<>|]', "", filename)
+    safe_filename = _UNSAFE_FILENAME_RE.sub("", filename)
 
     return safe_filename.strip()
 
 
+def create_session() -> requests.Session:
+    """
+    建立下載用的 requests.Session。
+    所有 PDF 都在同一主機上，重複使用 keep-alive 連線可省去每個檔案的 TCP/TLS 握手；
+    遇到暫時性的 5xx 錯誤時自動重試。
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["HEAD", "GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"User-Agent": "esg-bot-pcr-downloader/1.0", "Accept-Encoding": "gzip"}
+    )
+    return session
+
+
+def scan_downloaded_fids(folder: str) -> Set[str]:
+    """一次列出資料夾，回傳已下載檔案的 fid 集合 (檔名開頭為 "{fid}-")。"""
+    return {
+        entry.name[:FID_LENGTH]
+        for entry in os.scandir(folder)
+        if entry.is_file() and entry.name[FID_LENGTH : FID_LENGTH + 1] == "-"
+    }
+
+
 # --- 核心下載函數 ---
+def _download_one(
+    session: requests.Session, item: Dict[str, Any], downloaded_fids: Set[str]
+) -> Tuple[bool, str]:
+    """
+    下載單一 PCR 項目的 PDF。
+    回傳 (是否成功或已存在, 要輸出的訊息)；在執行緒池中執行，因此不直接 print。
+    """
+    document_name = item.get("document_name", "untitled")
+    download_link_suffix = item.get("download_link")
+
+    if not download_link_suffix:
+        return False, f"    [跳過] '{document_name}': 缺少 download_link 欄位。"
+
+    full_url = f"{DOWNLOAD_BASE_URL}{download_link_suffix}"
+
+    # 1. 提取 fid 作為文件名前綴
+    fid_prefix = extract_fid_from_link(download_link_suffix)
+
+    # 已有相同 fid 的檔案：直接跳過，不必為了取得原始文件名而發出請求
+    if fid_prefix in downloaded_fids:
+        return True, f"    [存在] '{document_name}' 已下載。跳過。"
+
+    # 2. 下載並獲取原始文件名
+    try:
+        # 必須使用 stream=True 並且不能立即下載全部內容，才能先讀取 Content-Disposition 標頭
+        response = session.get(full_url, stream=True, timeout=30)
+        response.raise_for_status()
+
+        # 從伺服器響應中解析出原始文件名
+        original_filename = get_filename_from_response(response)
+
+        # 3. 構建最終文件名: {fid}-{原始文件名}
+        final_filename = f"{fid_prefix}-{original_filename}"
+        file_path = os.path.join(PDF_FOLDER, final_filename)
+
+        # 4. 以 O_EXCL 建立並寫入文件：檔案已存在時直接失敗，檢查與建立在同一個系統呼叫內完成，
+        #    並行下載時也不會有兩條執行緒寫入同一個檔案
+        try:
+            fd = os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            response.close()  # 未讀取的串流需關閉，釋放連線
+            return True, f"    [存在] '{document_name}' 已下載。跳過。"
+
+        try:
+            with os.fdopen(fd, "wb", buffering=WRITE_CHUNK_SIZE) as pdf_file:
+                for chunk in response.iter_content(chunk_size=WRITE_CHUNK_SIZE):
+                    pdf_file.write(chunk)
+        except BaseException:
+            # 下載中斷時刪除不完整的檔案，否則下次執行會因 fid 已存在而跳過它
+            os.remove(file_path)
+            raise
+
+        return True, f"    [成功] '{document_name}' (FID: {fid_prefix}) 下載並儲存為: {final_filename}"
+
+    except requests.exceptions.RequestException as e:
+        status_code = getattr(e.response, "status_code", "N/A")
+        return False, f"    [失敗] 下載 '{document_name}' (Status: {status_code}) 失敗: {e}"
+    except Exception as e:
+        return False, f"    [失敗] 處理 '{document_name}' 時發生錯誤: {e}"
+
+
 def download_pdfs_from_json():
     """載入 JSON 數據並下載所有相關的 PDF 文件"""
 
@@ -113,56 +236,32 @@ def download_pdfs_from_json():
     success_count = 0
     fail_count = 0
 
-    for item in data:
-        document_name = item.get("document_name", "untitled")
-        download_link_suffix = item.get("download_link")
-
-        if not download_link_suffix:
-            print(f"    [跳過] '{document_name}': 缺少 download_link 欄位。")
-            fail_count += 1
-            continue
-
-        full_url = f"{DOWNLOAD_BASE_URL}{download_link_suffix}"
-
-        # 1. 提取 fid 作為文件名前綴
-        fid_prefix = extract_fid_from_link(download_link_suffix)
-
-        # 2. 下載並獲取原始文件名
-        print(f"    [下載中] '{document_name}' (FID: {fid_prefix})...")
-        try:
-            # 必須使用 stream=True 並且不能立即下載全部內容，才能先讀取 Content-Disposition 標頭
-            response = requests.get(full_url, stream=True, timeout=30)
-            response.raise_for_status()
-
-            # 從伺服器響應中解析出原始文件名
-            original_filename = get_filename_from_response(response)
-
-            # 3. 構建最終文件名: {fid}-{原始文件名}
-            final_filename = f"{fid_prefix}-{original_filename}"
-            file_path = os.path.join(PDF_FOLDER, final_filename)
-
-            if os.path.exists(file_path):
-                print(f"    [存在] '{document_name}' 已下載。跳過。")
+    # 下載是 I/O 密集工作：以有限大小的執行緒池並行下載，共用同一個 Session (連線池)
+    print(f"開始下載 {len(data)} 個項目 (並行數: {DOWNLOAD_WORKERS})...")
+    downloaded_fids = scan_downloaded_fids(PDF_FOLDER)
+    with create_session() as session, ThreadPoolExecutor(
+        max_workers=DOWNLOAD_WORKERS
+    ) as executor:
+        futures = [
+            executor.submit(_download_one, session, item, downloaded_fids)
+            for item in data
+        ]
+        # 進度訊息累積後每 PROGRESS_FLUSH_EVERY 筆一次寫出，而非逐筆 print
+        pending_messages: List[str] = []
+        for future in as_completed(futures):
+            ok, message = future.result()
+            pending_messages.append(message)
+            if ok:
                 success_count += 1
-                continue
-
-            # 4. 寫入文件
-            with open(file_path, "wb") as pdf_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    pdf_file.write(chunk)
-
-            print(f"    [成功] 下載並儲存為: {final_filename}")
-            success_count += 1
-
-        except requests.exceptions.RequestException as e:
-            status_code = getattr(e.response, "status_code", "N/A")
-            print(
-                f"    [失敗] 下載 '{document_name}' (Status: {status_code}) 失敗: {e}"
-            )
-            fail_count += 1
-        except Exception as e:
-            print(f"    [失敗] 處理 '{document_name}' 時發生錯誤: {e}")
-            fail_count += 1
+            else:
+                fail_count += 1
+            if len(pending_messages) >= PROGRESS_FLUSH_EVERY:
+                sys.stdout.write("\n".join(pending_messages) + "\n")
+                sys.stdout.flush()
+                pending_messages.clear()
+        if pending_messages:
+            sys.stdout.write("\n".join(pending_messages) + "\n")
+            sys.stdout.flush()
 
     print("\n--- 下載總結 ---")
     print(f"成功下載/已存在: {success_count} 筆")
@@ -1,6 +1,11 @@
+import asyncio
+import hashlib
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Query  # 引入 APIRouter
-from typing import List, Optional
+import threading
+import time
+from functools import lru_cache
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response  # 引入 APIRouter
+from typing import Dict, List, Optional
 from langchain_community.vectorstores import Chroma
 
 from chroma_manager import get_chroma_db
@@ -9,13 +14,9 @@ from pcr_services import (
     get_pcr_records_from_db,
     PCRRecord,
 )  # 從 pcr_services.py 匯入服務函數和模型
-import json
+import orjson
 from pathlib import Path
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 # 創建 APIRouter 實例
@@ -57,53 +58,112 @@ async def get_pcr_records(
         raise HTTPException(status_code=500, detail=f"伺服器內部錯誤: {e}")
 
 
+# pcr_list_scraped.json 解析後以 pcr_reg_no (小寫、去空白) 為鍵的索引；檔案修改時間改變時重新載入
+_pcr_index: Optional[Dict[str, dict]] = None
+_pcr_index_mtime: Optional[float] = None
+# 最近一次檢查檔案修改時間的時間點；間隔內的請求直接使用記憶體中的索引，不做任何檔案 I/O
+_pcr_index_checked_at = 0.0
+PCR_INDEX_CHECK_INTERVAL = 30.0  # 秒
+_pcr_index_lock = threading.Lock()
+# PCRRecord 的欄位名稱 (Pydantic v2 為 model_fields，v1 為 __fields__)，依模型定義的順序，只計算一次
+_PCR_FIELDS = tuple(getattr(PCRRecord, "model_fields", None) or PCRRecord.__fields__)
+
+
+@lru_cache(maxsize=1)
+def _resolve_pcr_json_path() -> Path:
+    """尋找 pcr_list_scraped.json (模組所在目錄，其次為上一層目錄)；找到後快取路徑。"""
+    # 檔案相對於此模組所在路徑
+    base = Path(__file__).resolve().parent
+    json_path = base.joinpath("pcr_list_scraped.json")
+
+    # 如果在同層找不到，嘗試專案根目錄
+    if not json_path.exists():
+        json_path = base.parent.joinpath("pcr_list_scraped.json")
+
+    if not json_path.exists():
+        logger.error(f"找不到 pcr_list_scraped.json (checked {json_path})")
+        raise HTTPException(status_code=500, detail="伺服器尚未載入 PCR 資料 (pcr_list_scraped.json 不存在)")
+    return json_path
+
+
+def _load_pcr_index() -> Dict[str, dict]:
+    """回傳 pcr_reg_no 索引；第一次呼叫或 JSON 檔案更新後才重新解析。"""
+    global _pcr_index, _pcr_index_mtime, _pcr_index_checked_at
+    json_path = _resolve_pcr_json_path()
+    mtime = json_path.stat().st_mtime
+    with _pcr_index_lock:
+        _pcr_index_checked_at = time.monotonic()
+        if _pcr_index is None or _pcr_index_mtime != mtime:
+            data = orjson.loads(json_path.read_bytes())
+
+            # 資料可能是列表
+            if not isinstance(data, list):
+                logger.error("pcr_list_scraped.json 格式錯誤，預期為 list")
+                raise HTTPException(status_code=500, detail="pcr_list_scraped.json 格式錯誤")
+
+            # 重複的登錄編號以第一筆為準 (與原本逐筆比對的行為一致)
+            index: Dict[str, dict] = {}
+            for entry in data:
+                reg_no = (entry.get("pcr_reg_no") or "").strip().lower()
+                if reg_no:
+                    index.setdefault(reg_no, entry)
+            _pcr_index, _pcr_index_mtime = index, mtime
+            _lookup_pcr_record.cache_clear()  # 資料已更新，清除舊的查詢結果
+            logger.info(f"已載入 {len(index)} 筆 PCR 登錄編號索引。")
+        return _pcr_index
+
+
+@lru_cache(maxsize=4096)
+def _lookup_pcr_record(reg_no_key: str) -> Optional[bytes]:
+    """
+    以正規化後的登錄編號查詢，回傳已序列化的 JSON 回應內容 (結果快取，索引重新載入時清除)。
+    呼叫前必須先執行 _load_pcr_index()。
+    """
+    entry = _pcr_index.get(reg_no_key)
+    if entry is None:
+        return None
+    # 本地 JSON 為受信任的資料：僅挑出 PCRRecord 欄位 (缺少的欄位為 None，與模型預設值相同)，
+    # 直接序列化一次；路由回傳 Response，FastAPI 不會再依 response_model 驗證與序列化
+    return orjson.dumps({field: entry.get(field) for field in _PCR_FIELDS})
+
+
+# 登錄編號對應的資料很少變動，允許用戶端與代理快取一小時
+BY_REG_NO_CACHE_CONTROL = "public, max-age=3600"
+
+
 @router.get(
     "/by_reg_no",
     response_model=PCRRecord,
     summary="依 PCR 登錄編號查詢單筆記錄",
     description="從本地 pcr_list_scraped.json 中以 pcr_reg_no 精確比對並回傳該筆記錄。",
 )
-async def get_pcr_record_by_reg_no(pcr_reg_no: str = Query(..., description="PCR 登錄編號，例如 24-011")):
+async def get_pcr_record_by_reg_no(
+    request: Request,
+    pcr_reg_no: str = Query(..., description="PCR 登錄編號，例如 24-011"),
+):
     """
     直接從本地的 `pcr_list_scraped.json` 檔案中尋找與 `pcr_reg_no` 完全相符的記錄並回傳。
     若找不到，回傳 404。
     """
     try:
-        # 檔案相對於此模組所在路徑
-        base = Path(__file__).resolve().parent
-        json_path = base.joinpath("pcr_list_scraped.json")
-
-        # 如果在同層找不到，嘗試專案根目錄
-        if not json_path.exists():
-            json_path = base.parent.joinpath("pcr_list_scraped.json")
-
-        if not json_path.exists():
-            logger.error(f"找不到 pcr_list_scraped.json (checked {json_path})")
-            raise HTTPException(status_code=500, detail="伺服器尚未載入 PCR 資料 (pcr_list_scraped.json 不存在)")
+        # 索引尚未載入或已超過檢查間隔時，才到執行緒中檢查檔案並 (必要時) 重新載入
+        if _pcr_index is None or time.monotonic() - _pcr_index_checked_at > PCR_INDEX_CHECK_INTERVAL:
+            await asyncio.to_thread(_load_pcr_index)
 
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # 精確比對 pcr_reg_no，忽略大小寫與前後空白
+        reg_no_key = (pcr_reg_no or "").strip().lower()
+        content = _lookup_pcr_record(reg_no_key)
+        if content is None:
+            # 找不到
+            raise HTTPException(status_code=404, detail=f"找不到 PCR 記錄: {pcr_reg_no}")
 
-        # 資料可能是列表
-        if not isinstance(data, list):
-            logger.error("pcr_list_scraped.json 格式錯誤，預期為 list")
-            raise HTTPException(status_code=500, detail="pcr_list_scraped.json 格式錯誤")
+        # ETag 隨資料檔版本改變；用戶端帶相同的 If-None-Match 時回傳 304，不必重送內容
+        etag = '"' + hashlib.md5(f"{_pcr_index_mtime}:{reg_no_key}".encode()).hexdigest() + '"'
+        headers = {"Cache-Control": BY_REG_NO_CACHE_CONTROL, "ETag": etag}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
 
-        # 精確比對 pcr_reg_no，忽略大小寫與前後空白
-        target = (pcr_reg_no or "").strip().lower()
-        for entry in data:
-            entry_reg = (entry.get("pcr_reg_no") or "").strip().lower()
-            if entry_reg == target:
-                # 返回 PCRRecord，允許部分欄位缺失
-                try:
-                    return PCRRecord(**entry)
-                except Exception:
-                    # 若 entry 包含多餘鍵，僅挑出 PCRRecord 欄位
-                    allowed = {k: v for k, v in entry.items() if k in PCRRecord.__fields__}
-                    return PCRRecord(**allowed)
-
-        # 找不到
-        raise HTTPException(status_code=404, detail=f"找不到 PCR 記錄: {pcr_reg_no}")
+        return Response(content=content, media_type="application/json", headers=headers)
 
     except HTTPException:
         raise
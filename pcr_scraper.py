@@ -1,10 +1,14 @@
 import httpx
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 import re
-import json
+import orjson
+import hashlib
+import os
 import logging
-import time
 import asyncio  # 引入 asyncio 以便直接執行 main_scraper
+import codecs
+import contextlib
+from typing import Optional
 
 # 配置日誌
 logging.basicConfig(
@@ -15,59 +19,309 @@ logger = logging.getLogger(__name__)
 # 基礎 URL
 BASE_URL = "https://cfp-calculate.tw/cfpc/Carbon/WebPage/FLPCRDoneList.aspx"
 
+# ASP.NET 頁面狀態相關的隱藏欄位 (frozenset：每個 hidden input 都要檢查一次，以雜湊查找)
+HIDDEN_FIELD_NAMES = frozenset(
+    {
+        "__VIEWSTATE",
+        "__VIEWSTATEGENERATOR",
+        "__EVENTVALIDATION",
+        "__EVENTTARGET",
+        "__EVENTARGUMENT",
+    }
+)
+
+# 初始頁面需要一併提交的輸入框 (以 id 辨識) 與狀態 radio button
+TEXT_INPUT_IDS = frozenset(
+    {
+        "ContentPlaceHolder1_txt_PCRName",
+        "ContentPlaceHolder1_tbx_ccccode",
+        "ContentPlaceHolder1_txt_Jointly",
+    }
+)
+RDB_STATUS_NAME = "ctl00$ContentPlaceHolder1$rdb_status"
+
+# 結果表格與分頁區塊的 XPath
+# 數據行：跳過表頭 (第一行)，且須有 td、不是單一 colspan cell 的分頁行 (不完整的數據行由呼叫端記錄警告後跳過)
+DATA_ROWS_XPATH = (
+    "(.//tr)[position() > 1][.//td]"
+    "[not(count(.//td) = 1 and .//td/@colspan)]"
+)
+PAGER_INFO_XPATH = "//span[contains(concat(' ', normalize-space(@class), ' '), ' pager ')]"
+PAGER_LINKS_XPATH = (
+    "(//div[contains(concat(' ', normalize-space(@class), ' '), ' stripeMe ')])[1]//a"
+)
+
+# 預先編譯的正規表示式 (每一列、每一頁都會用到，避免重複查詢 re 的快取)
+_JS_HREF_RE = re.compile(r"javascript:CallSubwin\('(\d+)'\)")
+_DOPOSTBACK_RE = re.compile(r"__doPostBack\('([^']+)'")
+_TOTAL_PAGES_RE = re.compile(r"共(\d+)頁")
+_CHK_NAME_RE = re.compile(r"ctl00\$ContentPlaceHolder1\$chk_type\$\d+")
+
+SCRAPER_USER_AGENT = "esg-bot-pcr-scraper/1.0"
+
+# 快取資料夾：
+# 1. 初始頁面表單數據，以初始 HTML 的雜湊為鍵，頁面沒變時直接沿用上次的解析結果
+# 2. GET 回應內容與其 ETag / Last-Modified，用於條件式請求 (伺服器回傳 304 時沿用快取內容)
+FORM_CACHE_DIR = ".cache"
+
+# 爬取結果：逐頁附加寫入 NDJSON，爬取完成後再轉成 JSON 陣列
+SCRAPED_NDJSON_FILE = "pcr_list_scraped.ndjson"
+SCRAPED_JSON_FILE = "pcr_list_scraped.json"
+
+# 回應的 Content-Type 未指定 charset 時使用的字元編碼 (網站為 ASP.NET，預設 UTF-8)
+PAGE_ENCODING = "utf-8"
+
+# 分頁請求之間的延遲 (秒)，避免過於頻繁的請求
+PAGE_REQUEST_DELAY = 1
+
+# 暫時性錯誤 (連線問題、逾時、429/5xx) 的重試：最多嘗試次數，與指數退避的起始/上限秒數
+FETCH_MAX_ATTEMPTS = 4
+FETCH_BACKOFF_BASE = 0.5
+FETCH_BACKOFF_MAX = 8
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+
+def _get_cache_paths(url: str) -> tuple[str, str]:
+    """GET 回應快取的 (驗證資訊, 內容) 檔案路徑。"""
+    key = hashlib.md5(url.encode("utf-8")).hexdigest()
+    base = os.path.join(FORM_CACHE_DIR, f"get_{key}")
+    return f"{base}.meta.json", f"{base}.html"
 
-async def fetch_page(client: httpx.AsyncClient, url: str, data: dict = None) -> str:
+
+def _load_cached_get(url: str) -> Optional[tuple[dict, bytes]]:
+    """讀取上次 GET 回應的 (驗證資訊, 內容)；沒有快取時回傳 None。"""
+    meta_path, body_path = _get_cache_paths(url)
+    try:
+        with open(meta_path, "rb") as f:
+            meta = orjson.loads(f.read())
+        with open(body_path, "rb") as f:
+            return meta, f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _conditional_headers(cached: Optional[tuple[dict, bytes]]) -> dict:
+    """依快取的驗證資訊建立 If-None-Match / If-Modified-Since 標頭。"""
+    if not cached:
+        return {}
+    meta = cached[0]
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _store_cached_get(url: str, response: httpx.Response, content: bytes) -> None:
+    """回應帶有 ETag 或 Last-Modified 時，保存驗證資訊與 (UTF-8) 內容供下次條件式請求使用。"""
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    if not (meta["etag"] or meta["last_modified"]):
+        return
+    meta_path, body_path = _get_cache_paths(url)
+    try:
+        os.makedirs(FORM_CACHE_DIR, exist_ok=True)
+        with open(body_path, "wb") as f:
+            f.write(content)
+        with open(meta_path, "wb") as f:
+            f.write(orjson.dumps(meta))
+    except OSError as e:
+        logger.warning("無法寫入頁面快取: %s", e)
+
+
+def _utf8_content(response: httpx.Response) -> bytes:
+    """
+    回傳 UTF-8 編碼的回應內容：依 Content-Type 的 charset 判斷編碼 (未指定時為 PAGE_ENCODING)，
+    已是 UTF-8 時直接使用原始 bytes，否則轉碼一次，讓 lxml 一律以 UTF-8 解析。
+    """
+    encoding = response.charset_encoding or PAGE_ENCODING
+    try:
+        codec = codecs.lookup(encoding).name
+    except LookupError:
+        logger.warning("未知的字元編碼 %r，改以 %s 解析", encoding, PAGE_ENCODING)
+        return response.content
+    if codec == "utf-8":
+        return response.content
+    return response.content.decode(codec, errors="replace").encode("utf-8")
+
+
+async def _request_page(client: httpx.AsyncClient, url: str, data: dict = None) -> bytes:
+    """送出一次 GET/POST 請求並回傳 UTF-8 內容；4xx/5xx 狀態碼會拋出 httpx.HTTPStatusError。"""
+    if data:
+        # 對於 POST 請求，使用 data 參數
+        response = await client.post(url, data=data)
+    else:
+        # 對於 GET 請求：帶上次回應的 ETag / Last-Modified 發出條件式請求
+        cached = _load_cached_get(url)
+        response = await client.get(url, headers=_conditional_headers(cached))
+        if response.status_code == 304 and cached:
+            logger.info("頁面未變更 (狀態碼: 304)，使用快取內容: %s", url)
+            return cached[1]
+    response.raise_for_status()  # 對於 4xx/5xx 狀態碼拋出異常
+    logger.info("成功獲取頁面: %s (狀態碼: %s)", url, response.status_code)
+    content = _utf8_content(response)
+    if not data:
+        _store_cached_get(url, response, content)
+    return content
+
+
+async def fetch_page(client: httpx.AsyncClient, url: str, data: dict = None) -> bytes:
     """
     非同步獲取網頁內容，支援 GET 和 POST 請求。
+    回傳 UTF-8 bytes 交給 lxml 解碼與解析 (UTF-8 回應直接使用原始 bytes，省去先在 Python 解碼成 str 的完整複製)。
+    遇到暫時性錯誤時以指數退避重試，避免單次失敗就中斷整個爬取。
     Args:
         client (httpx.AsyncClient): httpx 非同步客戶端。
         url (str): 目標 URL。
         data (dict): POST 請求的表單數據。
     Returns:
-        str: 網頁的 HTML 內容。
+        bytes: 網頁的 HTML 內容 (失敗時為空 bytes)。
+    """
+    for attempt in range(1, FETCH_MAX_ATTEMPTS + 1):
+        try:
+            return await _request_page(client, url, data)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            retryable = (
+                isinstance(e, httpx.TransportError)
+                or e.response.status_code in RETRYABLE_STATUS_CODES
+            )
+            if not retryable or attempt == FETCH_MAX_ATTEMPTS:
+                logger.error("請求失敗: %s", e)
+                return b""
+            delay = min(FETCH_BACKOFF_BASE * 2 ** (attempt - 1), FETCH_BACKOFF_MAX)
+            logger.warning("請求失敗 (第 %s 次)，%s 秒後重試: %s", attempt, delay, e)
+            await asyncio.sleep(delay)
+        except httpx.RequestError as e:
+            logger.error("請求失敗: %s", e)
+            return b""
+        except Exception as e:
+            logger.error("獲取頁面時發生未知錯誤: %s", e)
+            return b""
+    return b""
+
+
+async def fetch_page_after_delay(
+    client: httpx.AsyncClient, url: str, data: dict, delay: float
+) -> bytes:
+    """等待 delay 秒 (不阻塞事件迴圈) 後再送出 POST 請求。"""
+    await asyncio.sleep(delay)
+    return await fetch_page(client, url, data=data)
+
+
+def _parse_html(html_content: bytes):
     """
+    以 lxml 直接從 bytes 建立 HTML 樹 (解碼在 C 層完成)。
+    內容已由 _request_page 依回應的 charset 轉為 UTF-8。
+    lxml 的 parser 不能跨執行緒共用，因此每次建立新的 parser。
+    """
+    parser = lxml_html.HTMLParser(encoding="utf-8")
     try:
-        if data:
-            # 對於 POST 請求，使用 data 參數
-            response = await client.post(url, data=data, timeout=30)
-        else:
-            # 對於 GET 請求
-            response = await client.get(url, timeout=30)
-        response.raise_for_status()  # 對於 4xx/5xx 狀態碼拋出異常
-        logger.info(f"成功獲取頁面: {url} (狀態碼: {response.status_code})")
-        return response.text
-    except httpx.RequestError as e:
-        logger.error(f"請求失敗: {e}")
-        return ""
-    except Exception as e:
-        logger.error(f"獲取頁面時發生未知錯誤: {e}")
-        return ""
-
-
-def parse_pcr_table(html_content: str) -> list[dict]:
+        return lxml_html.document_fromstring(html_content, parser=parser)
+    except etree.ParserError as e:
+        # 例如回應只有空白：視為沒有內容的頁面 (找不到表格、隱藏欄位)，由呼叫端依一般流程停止
+        logger.warning("HTML 解析失敗，視為空白頁面: %s", e)
+        return lxml_html.document_fromstring("<html><body></body></html>")
+
+
+def _node_text(node, separator: str = " ") -> str:
     """
-    解析 HTML 內容，從表格中提取 PCR 數據。
+    取得節點 (含子孫) 的文字：每段文字去除首尾空白、略過空白段落後以 separator 連接
+    (<br> 前後的文字仍以空格分開)，再將換行換成空格。
+    與原本的 get_text(separator=" ", strip=True).replace("\n", " ").strip() 相同，
+    文字段落內部的連續空白 (例如 "某協會  與  公會") 保留不變。
+    """
+    return (
+        separator.join(text for text in (t.strip() for t in node.itertext()) if text)
+        .replace("\n", " ")
+        .strip()
+    )
+
+
+def _extract_text_cell(cell_content, entry: dict, header_key: str) -> None:
+    """提取文本內容，並清理換行符和多餘空格。"""
+    entry[header_key] = _node_text(cell_content)
+
+
+def _extract_download_cell(cell_content, entry: dict, header_key: str) -> None:
+    """提取下載連結。"""
+    link_tags = cell_content.xpath(".//a[@target='_blank']")
+    entry[header_key] = link_tags[0].get("href", "") if link_tags else ""
+
+
+def _extract_feedback_cell(cell_content, entry: dict, header_key: str) -> None:
+    """提取意見回饋的 JavaScript 函數參數 (數字 ID)。"""
+    entry[header_key] = ""
+    for js_link in cell_content.iter("a"):
+        match = _JS_HREF_RE.search(js_link.get("href", ""))
+        if match:
+            entry[header_key] = match.group(1)
+            break
+
+
+def _extract_doc_reg_cell(cell_content, entry: dict, header_key: str) -> None:
+    """合併欄位 (文件名稱 PCR登錄編號)：直接拆成兩個最終欄位，不寫入合併鍵。"""
+    # 以空格分隔：文件名稱取第一段、登錄編號取最後一段 (與原本 split(" ") 取 [0] / [-1] 相同)
+    name, _, rest = _node_text(cell_content).partition(" ")
+    entry["document_name"] = name
+    entry["pcr_reg_no"] = rest.rpartition(" ")[2]
+
+
+def _extract_app_eff_cell(cell_content, entry: dict, header_key: str) -> None:
+    """合併欄位 (核准日期 有效期限)。"""
+    # 核准日期取第一段，有效期限為其餘部分
+    entry["approval_date"], _, entry["effective_date"] = _node_text(
+        cell_content
+    ).partition(" ")
+
+
+# 需要特殊處理的欄位；其他欄位使用 _extract_text_cell
+_CELL_HANDLERS = {
+    "download_link": _extract_download_cell,
+    "feedback_link": _extract_feedback_cell,
+    "document_name_reg_no": _extract_doc_reg_cell,
+    "approval_effective_date": _extract_app_eff_cell,
+}
+
+
+def parse_pcr_table(html_content: bytes) -> tuple[list[dict], dict]:
+    """
+    解析 HTML 內容，從表格中提取 PCR 數據，並在同一次解析中取出分頁所需的隱藏欄位。
     Args:
-        html_content (str): 網頁的 HTML 內容。
+        html_content (bytes): 網頁的 HTML 內容。
+    Returns:
+        tuple[list[dict], dict]: (包含 PCR 數據的字典列表, 隱藏欄位的字典)。
+    """
+    # 表格解析是爬蟲的 CPU 熱點：直接以 lxml 建樹並用 XPath 查找，不經過 BeautifulSoup 的 Python 層
+    root = _parse_html(html_content)
+    return extract_pcr_records(root), _extract_hidden_fields(root)
+
+
+def extract_pcr_records(root) -> list[dict]:
+    """
+    從已解析的 HTML 樹中提取 PCR 數據表格的所有記錄。
+    分頁時在執行緒中呼叫，與下一頁的請求重疊進行。
+    Args:
+        root: _parse_html 產生的 HTML 樹。
     Returns:
         list[dict]: 包含 PCR 數據的字典列表。
     """
-    soup = BeautifulSoup(html_content, "html.parser")
-    table = soup.find("table", id="ContentPlaceHolder1_sgv")
+    tables = root.xpath("//table[@id='ContentPlaceHolder1_sgv']")
 
-    if not table:
+    if not tables:
         logger.warning("未找到 PCR 數據表格 (ID: ContentPlaceHolder1_sgv)。")
         return []
+    table = tables[0]
 
     headers = []
     # 提取表頭 (假設第一行是表頭)
-    header_row = table.find("tr")
-    if header_row:
-        for th in header_row.find_all("th"):
+    header_rows = table.xpath("(.//tr)[1]")
+    if header_rows:
+        for th in header_rows[0].xpath(".//th"):
             # 清理表頭文本，移除 <br> 和多餘空格
-            header_text = (
-                th.get_text(separator=" ", strip=True).replace("\n", " ").strip()
-            )
+            header_text = _node_text(th)
             headers.append(header_text)
 
     # 預期的表頭順序和對應的鍵名，用於數據映射
@@ -85,175 +339,202 @@ def parse_pcr_table(html_content: str) -> list[dict]:
     # 將實際提取的表頭映射到預期的鍵名
     mapped_headers = [expected_headers_map.get(h, h) for h in headers]
 
+    # 表頭在所有數據行中相同：預先決定每一欄的擷取函數，數據行中直接依欄位位置呼叫
+    cell_handlers = [
+        (header_key, _CELL_HANDLERS.get(header_key, _extract_text_cell))
+        for header_key in mapped_headers
+    ]
+
     pcr_data = []
-    # 遍歷每一行數據 (跳過表頭行)
-    # 數據行通常有固定數量的 <td> 元素，而分頁行可能只有一個 colspan 的 <td>
-    for row in table.find_all("tr")[1:]:  # 從第二行開始 (跳過表頭)
-        cells = row.find_all("td")
-
-        # 判斷是否為數據行：
-        # 1. 如果沒有 cells，則跳過空行
-        # 2. 如果只有一個 cell 且帶有 colspan 屬性，則判斷為分頁行，跳過
-        # 3. 如果 cells 數量少於預期的表頭數量，則判斷為不完整數據行，跳過
-        if not cells:
-            continue
-        if len(cells) == 1 and cells[0].has_attr("colspan"):
-            logger.debug(f"跳過分頁行: {cells[0].get_text(strip=True)}")
-            continue
+    # 遍歷每一行數據 (跳過表頭行)，由 XPath 在 lxml 內直接篩掉：
+    # 1. 沒有 cells 的空行
+    # 2. 只有一個帶 colspan 屬性 cell 的分頁行
+    # cells 數量少於預期表頭數量的不完整數據行則記錄警告後跳過
+    for row in table.xpath(DATA_ROWS_XPATH):
+        cells = row.xpath(".//td")
         if len(cells) < len(mapped_headers):
-            logger.warning(f"行數據不完整或格式異常，跳過: {row.get_text(strip=True)}")
+            logger.warning("行數據不完整或格式異常，跳過: %s", _node_text(row, ""))
             continue
 
         entry = {}
-        for i, header_key in enumerate(mapped_headers):
-            cell_content = cells[i]
-            if header_key == "download_link":
-                # 提取下載連結
-                link_tag = cell_content.find("a", target="_blank")
-                entry[header_key] = (
-                    link_tag["href"] if link_tag and "href" in link_tag.attrs else ""
-                )
-            elif header_key == "feedback_link":
-                # 提取意見回饋的 JavaScript 函數參數 (數字 ID)
-                js_link = cell_content.find(
-                    "a", href=re.compile(r"javascript:CallSubwin\(\'(\d+)\'\)")
-                )
-                if js_link:
-                    match = re.search(r"CallSubwin\(\'(\d+)\'\)", js_link["href"])
-                    entry[header_key] = match.group(1) if match else ""
-                else:
-                    entry[header_key] = ""
-            else:
-                # 提取文本內容，並清理換行符和多餘空格
-                text_content = (
-                    cell_content.get_text(separator=" ", strip=True)
-                    .replace("\n", " ")
-                    .strip()
-                )
-                entry[header_key] = text_content
-
-        # 進一步解析 'document_name_reg_no' (文件名稱 PCR登錄編號)
-        doc_reg_parts = entry.get("document_name_reg_no", "").split(" ")
-        entry["document_name"] = doc_reg_parts[0] if doc_reg_parts else ""
-        entry["pcr_reg_no"] = doc_reg_parts[-1] if len(doc_reg_parts) > 1 else ""
-        del entry["document_name_reg_no"]  # 移除原始合併欄位
-
-        # 進一步解析 'approval_effective_date' (核准日期 有效期限)
-        app_eff_parts = entry.get("approval_effective_date", "").split(" ")
-        entry["approval_date"] = app_eff_parts[0] if app_eff_parts else ""
-        entry["effective_date"] = (
-            " ".join(app_eff_parts[1:]) if len(app_eff_parts) > 1 else ""
-        )
-        del entry["approval_effective_date"]  # 移除原始合併欄位
-
+        for cell_content, (header_key, handler) in zip(cells, cell_handlers):
+            handler(cell_content, entry, header_key)
 
         pcr_data.append(entry)
 
     return pcr_data
 
 
-def extract_initial_form_data_and_checkboxes(html_content: str) -> dict:
+def extract_initial_form_data_and_checkboxes(html_content: bytes) -> dict:
     """
     從 HTML 內容中提取 ASP.NET Web Forms 的隱藏欄位和所有文件類型 checkbox 的值。
     這個函數用於首次載入頁面時，獲取所有需要提交的表單數據，包括所有 checkbox。
     Args:
-        html_content (str): 網頁的 HTML 內容。
+        html_content (bytes): 網頁的 HTML 內容。
     Returns:
         dict: 包含 __VIEWSTATE, __EVENTVALIDATION 以及所有 chk_type 值的字典。
     """
-    soup = BeautifulSoup(html_content, "html.parser")
+    # 只走訪一次 DOM：以單一 XPath 取出所有具 name 的 <input>，再依 type / name / id 分派
+    root = _parse_html(html_content)
     form_data = {}
-    # 提取所有隱藏欄位
-    for input_tag in soup.find_all("input", type="hidden"):
-        if input_tag.get("name") in [
-            "__VIEWSTATE",
-            "__VIEWSTATEGENERATOR",
-            "__EVENTVALIDATION",
-            "__EVENTTARGET",
-            "__EVENTARGUMENT",
-        ]:
-            form_data[input_tag.get("name")] = input_tag.get("value", "")
-
-    # 提取所有 chk_type 的值，並將它們加入 form_data，模擬全部勾選
-    for chk in soup.find_all(
-        "input",
-        {
-            "type": "checkbox",
-            "name": re.compile(r"ctl00\$ContentPlaceHolder1\$chk_type\$\d+"),
-        },
-    ):
-        form_data[chk["name"]] = chk["value"]
-
-    # 提取 radio button 的值，確保 '全部' 被選中
-    rdb_status_all = soup.find(
-        "input", {"name": "ctl00$ContentPlaceHolder1$rdb_status", "value": "全部"}
-    )
-    if rdb_status_all:
-        form_data[rdb_status_all["name"]] = rdb_status_all["value"]
+    for input_tag in root.xpath("//input[@name]"):
+        input_type = input_tag.get("type")
+        name = input_tag.get("name")
+        input_id = input_tag.get("id")
+
+        if input_type == "hidden":
+            # 提取隱藏欄位
+            if name in HIDDEN_FIELD_NAMES:
+                form_data[name] = input_tag.get("value", "")
+        elif input_type == "checkbox" and _CHK_NAME_RE.search(name):
+            # 提取所有 chk_type 的值，並將它們加入 form_data，模擬全部勾選
+            form_data[name] = input_tag.get("value", "")
+        elif name == RDB_STATUS_NAME:
+            # 提取 radio button 的值，確保 '全部' 被選中
+            if input_tag.get("value") == "全部":
+                form_data[name] = "全部"
+        elif input_id in TEXT_INPUT_IDS:
+            # 提取其他輸入框的當前值，以確保 POST 請求的完整性 (通常為空，但仍需包含)
+            form_data[name] = input_tag.get("value", "")
+        elif input_id == "ContentPlaceHolder1_btn_qry":
+            # 確保查詢按鈕的 target 也被識別，用於第一次提交
+            form_data["btn_qry_name"] = name
 
-    # 提取其他輸入框的當前值，以確保 POST 請求的完整性 (通常為空，但仍需包含)
-    txt_pcr_name = soup.find("input", id="ContentPlaceHolder1_txt_PCRName")
-    if txt_pcr_name:
-        form_data[txt_pcr_name["name"]] = txt_pcr_name.get("value", "")
+    return form_data
 
-    tbx_ccccode = soup.find("input", id="ContentPlaceHolder1_tbx_ccccode")
-    if tbx_ccccode:
-        form_data[tbx_ccccode["name"]] = tbx_ccccode.get("value", "")
 
-    txt_jointly = soup.find("input", id="ContentPlaceHolder1_txt_Jointly")
-    if txt_jointly:
-        form_data[txt_jointly["name"]] = txt_jointly.get("value", "")
+def find_postback_target(root, page_num: int) -> Optional[str]:
+    """
+    從分頁連結中找出指定頁碼的 __doPostBack 目標。
+    找到包含分頁連結的 div (class="stripeMe")，在這個容器內的所有 <a> 連結即分頁連結。
+    Returns:
+        Optional[str]: PostBack 目標；找不到時為 None。
+    """
+    pager_links = root.xpath(PAGER_LINKS_XPATH)
+    logger.debug("第 %s 頁找到 %s 個分頁連結。", page_num, len(pager_links))
+    for link in pager_links:
+        link_text = _node_text(link, "")
+        link_href = link.get("href", "")
+        logger.debug("連結文本: '%s', href: '%s'", link_text, link_href)
+
+        # 檢查連結文本是否為當前頁碼
+        if link_text == str(page_num):
+            match = _DOPOSTBACK_RE.search(link_href)
+            if match:
+                logger.debug(
+                    "找到第 %s 頁的 PostBack 目標: %s", page_num, match.group(1)
+                )
+                return match.group(1)
+    return None
 
-    # 確保查詢按鈕的 target 也被識別，用於第一次提交
-    btn_qry = soup.find("input", id="ContentPlaceHolder1_btn_qry")
-    if btn_qry and btn_qry.get("name"):
-        form_data["btn_qry_name"] = btn_qry["name"]
 
-    return form_data
+async def collect_page_records(page_num: int, root, output_path: str) -> int:
+    """
+    在執行緒中提取一頁的記錄 (讓事件迴圈可同時處理下一頁的請求)，並附加寫入 NDJSON。
+    Returns:
+        int: 該頁的記錄數；0 代表已達最後一頁或解析錯誤。
+    """
+    current_page_records = await asyncio.to_thread(extract_pcr_records, root)
+    if not current_page_records:
+        logger.info("第 %s 頁沒有找到記錄，可能已達最後一頁或解析錯誤。", page_num)
+        return 0
+    append_records_ndjson(output_path, current_page_records)
+    logger.info("第 %s 頁抓取到 %s 條記錄。", page_num, len(current_page_records))
+    return len(current_page_records)
 
 
-def extract_hidden_form_fields(html_content: str) -> dict:
+def load_initial_form_data(initial_html: bytes) -> dict:
     """
-    從 HTML 內容中提取 ASP.NET Web Forms 的隱藏欄位 (__VIEWSTATE, __EVENTVALIDATION 等)。
-    這個函數用於後續分頁時，更新頁面狀態。
+    取得初始頁面的表單數據：初始 HTML 與上次相同時讀取快取，否則解析後寫入快取。
     Args:
-        html_content (str): 網頁的 HTML 內容。
+        initial_html (bytes): 初始頁面的 HTML 內容。
     Returns:
-        dict: 包含隱藏欄位的字典。
+        dict: extract_initial_form_data_and_checkboxes 的結果。
+    """
+    key = hashlib.md5(initial_html).hexdigest()
+    cache_path = os.path.join(FORM_CACHE_DIR, f"init_{key}.json")
+    try:
+        with open(cache_path, "rb") as f:
+            form_data = orjson.loads(f.read())
+        logger.info("初始頁面未變更，使用快取的表單數據: %s", cache_path)
+        return form_data
+    except (OSError, ValueError):
+        pass
+
+    form_data = extract_initial_form_data_and_checkboxes(initial_html)
+    try:
+        os.makedirs(FORM_CACHE_DIR, exist_ok=True)
+        with open(cache_path, "wb") as f:
+            f.write(orjson.dumps(form_data))
+    except OSError as e:
+        logger.warning("無法寫入表單數據快取: %s", e)
+    return form_data
+
+
+def _extract_hidden_fields(root) -> dict:
+    """
+    從已解析的 HTML 樹中提取 ASP.NET Web Forms 的隱藏欄位 (__VIEWSTATE, __EVENTVALIDATION 等)。
+    由 parse_pcr_table 在解析表格時一併呼叫，用於後續分頁時更新頁面狀態。
     """
-    soup = BeautifulSoup(html_content, "html.parser")
     form_data = {}
-    for input_tag in soup.find_all("input", type="hidden"):
-        if input_tag.get("name") in [
-            "__VIEWSTATE",
-            "__VIEWSTATEGENERATOR",
-            "__EVENTVALIDATION",
-            "__EVENTTARGET",
-            "__EVENTARGUMENT",
-        ]:
-            form_data[input_tag.get("name")] = input_tag.get("value", "")
+    for input_tag in root.xpath("//input[@type='hidden'][@name]"):
+        name = input_tag.get("name")
+        if name in HIDDEN_FIELD_NAMES:
+            form_data[name] = input_tag.get("value", "")
     return form_data
 
 
-async def scrape_all_pcr_data() -> list[dict]:
+def append_records_ndjson(output_path: str, records: list[dict]) -> None:
+    """將一頁的記錄以 NDJSON (每行一筆 JSON) 附加寫入檔案。"""
+    with open(output_path, "ab") as f:
+        f.write(b"".join(orjson.dumps(record) + b"\n" for record in records))
+
+
+def create_scraper_client() -> httpx.AsyncClient:
+    """
+    建立爬蟲用的 httpx.AsyncClient。
+    所有請求都送往同一主機：啟用 HTTP/2 並保持 keep-alive，讓分頁請求共用同一條連線。
+    """
+    limits = httpx.Limits(
+        max_keepalive_connections=10, max_connections=20, keepalive_expiry=60
+    )
+    return httpx.AsyncClient(
+        http2=True,
+        limits=limits,
+        headers={"User-Agent": SCRAPER_USER_AGENT, "Accept-Encoding": "gzip"},
+        timeout=httpx.Timeout(30.0, connect=10.0),
+    )
+
+
+async def scrape_all_pcr_data(
+    output_path: str = SCRAPED_NDJSON_FILE,
+    client: Optional[httpx.AsyncClient] = None,
+) -> int:
     """
-    爬取所有 PCR 頁面並收集數據。
+    爬取所有 PCR 頁面，每解析完一頁就把記錄附加寫入 NDJSON 檔案，
+    記憶體中只保留當前頁的數據。
+    Args:
+        output_path (str): NDJSON 輸出檔案路徑 (開始爬取時清空)。
+        client (Optional[httpx.AsyncClient]): 要重複使用的客戶端 (由呼叫端負責關閉)，
+            多次爬取時傳入同一個客戶端可沿用已建立的連線；未提供時建立一個並在結束時關閉。
     Returns:
-        list[dict]: 包含所有 PCR 數據的列表。
+        int: 寫入的 PCR 記錄總數。
     """
-    all_pcr_records = []
+    total_records = 0
+    open(output_path, "wb").close()
 
-    async with httpx.AsyncClient() as client:
+    # 呼叫端提供的客戶端不在這裡關閉
+    async with (
+        create_scraper_client() if client is None else contextlib.nullcontext(client)
+    ) as client:
         # --- 步驟 1: 獲取初始頁面並提取表單數據和所有 checkbox 值 ---
         logger.info("正在獲取初始頁面並提取表單數據...")
         initial_html = await fetch_page(client, BASE_URL)
         if not initial_html:
-            return []
+            return 0
 
-        # 這裡使用新的函數來提取所有初始表單數據，包括所有 checkbox 的值
-        form_data_for_initial_query = extract_initial_form_data_and_checkboxes(
-            initial_html
-        )
+        # 這裡使用新的函數來提取所有初始表單數據，包括所有 checkbox 的值 (頁面未變更時讀取快取)
+        form_data_for_initial_query = load_initial_form_data(initial_html)
 
         # --- 步驟 2: 模擬點擊「查詢」按鈕，載入所有數據 ---
         logger.info("模擬點擊「查詢」按鈕以載入所有數據...")
@@ -262,18 +543,8 @@ async def scrape_all_pcr_data() -> list[dict]:
             "btn_qry_name", "ctl00$ContentPlaceHolder1$btn_qry"
         )  # 預設值以防萬一
 
-        # 創建用於提交查詢的 POST 數據
-        query_post_data = {
-            "__EVENTTARGET": query_button_target,
-            "__EVENTARGUMENT": "",
-            "__VIEWSTATE": form_data_for_initial_query.get("__VIEWSTATE", ""),
-            "__VIEWSTATEGENERATOR": form_data_for_initial_query.get(
-                "__VIEWSTATEGENERATOR", ""
-            ),
-            "__EVENTVALIDATION": form_data_for_initial_query.get(
-                "__EVENTVALIDATION", ""
-            ),
-            # 包含其他輸入框的當前值（通常為空）
+        # 不隨分頁改變的表單欄位只組一次：其他輸入框的當前值 (通常為空) 與所有文件類型 checkbox
+        base_post_data = {
             "ctl00$ContentPlaceHolder1$txt_PCRName": form_data_for_initial_query.get(
                 "ctl00$ContentPlaceHolder1$txt_PCRName", ""
             ),
@@ -290,82 +561,74 @@ async def scrape_all_pcr_data() -> list[dict]:
         # 添加所有文件類型 checkbox 的值，模擬全部勾選
         for key, value in form_data_for_initial_query.items():
             if key.startswith("ctl00$ContentPlaceHolder1$chk_type$"):
-                query_post_data[key] = value
+                base_post_data[key] = value
+
+        # 創建用於提交查詢的 POST 數據
+        query_post_data = {
+            **base_post_data,
+            "__EVENTTARGET": query_button_target,
+            "__EVENTARGUMENT": "",
+            "__VIEWSTATE": form_data_for_initial_query.get("__VIEWSTATE", ""),
+            "__VIEWSTATEGENERATOR": form_data_for_initial_query.get(
+                "__VIEWSTATEGENERATOR", ""
+            ),
+            "__EVENTVALIDATION": form_data_for_initial_query.get(
+                "__EVENTVALIDATION", ""
+            ),
+        }
 
         # 提交查詢請求
         query_result_html = await fetch_page(client, BASE_URL, data=query_post_data)
         if not query_result_html:
             logger.error("未能成功提交查詢請求。")
-            return []
-
-        # 更新 form_data 以便後續分頁使用最新的狀態 (只提取隱藏欄位)
-        form_data_for_pagination = extract_hidden_form_fields(query_result_html)
+            return 0
 
         # --- 步驟 3: 解析第一頁（查詢結果頁）的數據 ---
+        # 同一棵 HTML 樹同時提供記錄、隱藏欄位 (後續分頁使用最新的狀態) 與分頁資訊
         page_num = 1
-        current_page_records = parse_pcr_table(query_result_html)
-        all_pcr_records.extend(current_page_records)
+        last_page_root = _parse_html(query_result_html)
+        form_data_for_pagination = _extract_hidden_fields(last_page_root)
+        current_page_records = extract_pcr_records(last_page_root)
+        append_records_ndjson(output_path, current_page_records)
+        total_records += len(current_page_records)
         logger.info(
-            f"第 {page_num} 頁抓取到 {len(current_page_records)} 條記錄 (查詢結果頁)。"
+            "第 %s 頁抓取到 %s 條記錄 (查詢結果頁)。", page_num, len(current_page_records)
         )
 
         # 查找總頁數
-        soup = BeautifulSoup(query_result_html, "html.parser")
         # 修正總頁數提取邏輯：從包含 "第X頁/共Y頁" 的 span 元素中提取
-        pager_info_span = soup.find("span", class_="pager")
+        pager_info_spans = last_page_root.xpath(PAGER_INFO_XPATH)
         total_pages = 1
-        if pager_info_span:
-            pager_text = pager_info_span.get_text(strip=True)
-            match = re.search(r"共(\d+)頁", pager_text)
+        if pager_info_spans:
+            pager_text = _node_text(pager_info_spans[0], "")
+            match = _TOTAL_PAGES_RE.search(pager_text)
             if match:
                 # total_pages = int(2)
                 total_pages = int(match.group(1))
-                logger.info(f"總頁數: {total_pages}")
+                logger.info("總頁數: %s", total_pages)
             else:
                 logger.warning("未能在分頁資訊中找到總頁數，假設只有一頁。")
         else:
             logger.warning("未找到分頁資訊容器，假設只有一頁。")
 
         # --- 步驟 4: 遍歷後續分頁 ---
-        # 這裡需要一個變數來保存上一頁的 HTML，以便從中提取下一頁的 PostBack 目標
-        last_page_html = query_result_html
+        # last_page_root 保存上一頁的 HTML 樹，以便從中提取下一頁的 PostBack 目標
+        # pending_page 為已取得但尚未提取記錄的頁面 (頁碼, HTML 樹)：
+        # 等下一頁的請求送出後才提取，讓記錄提取與網路等待重疊
+        pending_page = None
 
         for page_num in range(2, total_pages + 1):
-            logger.info(f"正在獲取第 {page_num} 頁...")
-
-            next_page_link_target = None
-            # 從上一頁的 HTML 中提取分頁連結
-            current_soup_for_pager = BeautifulSoup(last_page_html, "html.parser")
-
-            # 找到包含分頁連結的 div，它是表格的下一個兄弟元素
-            pager_container_div = current_soup_for_pager.find("div", class_="stripeMe")
-
-            if pager_container_div:
-                # 在這個容器內找到所有 <a> 連結 (這些是分頁連結)
-                pager_links = pager_container_div.find_all("a")
-
-                logger.debug(f"第 {page_num} 頁找到 {len(pager_links)} 個分頁連結。")
-                for link in pager_links:
-                    link_text = link.get_text(strip=True)
-                    link_href = link.get("href", "")
-                    logger.debug(f"連結文本: '{link_text}', href: '{link_href}'")
-
-                    # 檢查連結文本是否為當前頁碼
-                    if link_text == str(page_num):
-                        match = re.search(r"__doPostBack\('([^']+)'", link_href)
-                        if match:
-                            next_page_link_target = match.group(1)
-                            logger.debug(
-                                f"找到第 {page_num} 頁的 PostBack 目標: {next_page_link_target}"
-                            )
-                            break
+            logger.info("正在獲取第 %s 頁...", page_num)
 
+            # 從上一頁的 HTML 樹中提取這一頁的 PostBack 目標
+            next_page_link_target = find_postback_target(last_page_root, page_num)
             if not next_page_link_target:
-                logger.warning(f"未找到第 {page_num} 頁的 PostBack 目標，停止爬取。")
+                logger.warning("未找到第 %s 頁的 PostBack 目標，停止爬取。", page_num)
                 break
 
-            # 構建分頁的 POST 數據
+            # 構建分頁的 POST 數據：固定欄位沿用 base_post_data，只覆寫頁面狀態與 PostBack 目標
             post_data = {
+                **base_post_data,
                 "__EVENTTARGET": next_page_link_target,
                 "__EVENTARGUMENT": "",
                 "__VIEWSTATE": form_data_for_pagination.get("__VIEWSTATE", ""),
@@ -375,65 +638,69 @@ async def scrape_all_pcr_data() -> list[dict]:
                 "__EVENTVALIDATION": form_data_for_pagination.get(
                     "__EVENTVALIDATION", ""
                 ),
-                # 再次包含所有表單欄位的值，確保狀態一致性
-                "ctl00$ContentPlaceHolder1$txt_PCRName": form_data_for_initial_query.get(
-                    "ctl00$ContentPlaceHolder1$txt_PCRName", ""
-                ),
-                "ctl00$ContentPlaceHolder1$txt_Jointly": form_data_for_initial_query.get(
-                    "ctl00$ContentPlaceHolder1$txt_Jointly", ""
-                ),
-                "ctl00$ContentPlaceHolder1$tbx_ccccode": form_data_for_initial_query.get(
-                    "ctl00$ContentPlaceHolder1$tbx_ccccode", ""
-                ),
-                "ctl00$ContentPlaceHolder1$rdb_status": form_data_for_initial_query.get(
-                    "ctl00$ContentPlaceHolder1$rdb_status", "全部"
-                ),
             }
-            # 再次添加所有文件類型 checkbox 的值 (從初始提取的數據中獲取)
-            for key, value in form_data_for_initial_query.items():
-                if key.startswith("ctl00$ContentPlaceHolder1$chk_type$"):
-                    post_data[key] = value
 
-            # 執行 POST 請求
-            next_page_html = await fetch_page(client, BASE_URL, data=post_data)
+            # 先送出這一頁的 POST 請求 (延遲以非阻塞的 asyncio.sleep 完成，避免過於頻繁的請求)，
+            # 在等待期間提取上一頁的記錄；請求只依賴上一頁的 __VIEWSTATE，因此最多預先抓取一頁
+            next_page_task = asyncio.create_task(
+                fetch_page_after_delay(client, BASE_URL, post_data, PAGE_REQUEST_DELAY)
+            )
+            if pending_page is not None:
+                page_record_count = await collect_page_records(*pending_page, output_path)
+                pending_page = None
+                if not page_record_count:
+                    next_page_task.cancel()
+                    break
+                total_records += page_record_count
+
+            next_page_html = await next_page_task
             if not next_page_html:
-                logger.error(f"無法獲取第 {page_num} 頁的內容，停止爬取。")
+                logger.error("無法獲取第 %s 頁的內容，停止爬取。", page_num)
                 break
 
-            # 更新 form_data_for_pagination 以便下一輪請求使用最新的 __VIEWSTATE 等
-            form_data_for_pagination = extract_hidden_form_fields(next_page_html)
-            # 更新 last_page_html 以便下一輪提取分頁連結
-            last_page_html = next_page_html
-
-            # 解析當前頁數據
-            current_page_records = parse_pcr_table(next_page_html)
-            if not current_page_records:
-                logger.info(
-                    f"第 {page_num} 頁沒有找到記錄，可能已達最後一頁或解析錯誤。"
-                )
-                break
-            all_pcr_records.extend(current_page_records)
-            logger.info(f"第 {page_num} 頁抓取到 {len(current_page_records)} 條記錄。")
+            # 在執行緒中建立 HTML 樹 (不阻塞事件迴圈)，先取出隱藏欄位，
+            # 以便下一輪請求使用最新的 __VIEWSTATE 等；記錄留到下一輪請求送出後再提取
+            last_page_root = await asyncio.to_thread(_parse_html, next_page_html)
+            form_data_for_pagination = _extract_hidden_fields(last_page_root)
+            pending_page = (page_num, last_page_root)
 
-            # 為了避免過於頻繁的請求，可以加入延遲
-            time.sleep(1)  # 延遲 1 秒
+        # 最後取得的一頁沒有後續請求可以重疊，直接提取
+        if pending_page is not None:
+            total_records += await collect_page_records(*pending_page, output_path)
 
-    return all_pcr_records
+    return total_records
 
 
-async def main_scraper():
+def convert_ndjson_to_json(ndjson_path: str, json_path: str) -> None:
+    """
+    以單次串流將 NDJSON 轉成縮排的 JSON 陣列，一次只載入一筆記錄。
+    輸出與 orjson.dumps(records, option=OPT_INDENT_2) 相同。
+    """
+    with open(ndjson_path, "rb") as src, open(json_path, "wb") as dst:
+        dst.write(b"[")
+        separator = b"\n  "
+        for line in src:
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            # orjson 以 C 實作序列化 (非 ASCII 字元直接輸出 UTF-8)；orjson 只支援 2 格縮排
+            dumped = orjson.dumps(record, option=orjson.OPT_INDENT_2)
+            dst.write(separator + dumped.replace(b"\n", b"\n  "))
+            separator = b",\n  "
+        dst.write(b"\n]" if separator == b",\n  " else b"]")
+
+
+async def main_scraper() -> int:
     logger.info("開始爬取環境部 PCR 清單...")
-    pcr_data = await scrape_all_pcr_data()
-
-    if pcr_data:
-        logger.info(f"總共抓取到 {len(pcr_data)} 條 PCR 記錄。")
-        with open("pcr_list_scraped.json", "w", encoding="utf-8") as f:
-            json.dump(pcr_data, f, ensure_ascii=False, indent=4)
-        logger.info("數據已儲存到 pcr_list_scraped.json")
-        return pcr_data
+    total_records = await scrape_all_pcr_data(SCRAPED_NDJSON_FILE)
+
+    if total_records:
+        logger.info("總共抓取到 %s 條 PCR 記錄。", total_records)
+        convert_ndjson_to_json(SCRAPED_NDJSON_FILE, SCRAPED_JSON_FILE)
+        logger.info("數據已儲存到 %s", SCRAPED_JSON_FILE)
     else:
         logger.warning("未能抓取到任何 PCR 數據。")
-        return []
+    return total_records
 
 
 if __name__ == "__main__":
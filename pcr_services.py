@@ -1,29 +1,32 @@
+import asyncio
+import os
 import sqlite3
 import logging
-from typing import Any, Dict, List, Optional
-from pydantic import BaseModel  # 引入 BaseModel 以便在服務層定義返回模型
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
 from langchain_community.vectorstores import Chroma
 from langchain.docstore.document import Document
 from collections import Counter
 
-from db import get_db_connection  # 從 db.py 匯入資料庫連線函數
+from db import (  # 從 db.py 匯入資料庫連線與全文索引
+    FTS_MIN_QUERY_LENGTH,
+    FTS_TABLE,
+    fts_index_available,
+    get_db_connection,
+)
 from pcr_models import PCRRecord  # 從 pcr_models.py 匯入 PCRRecord 模型
 
 logger = logging.getLogger(__name__)
 
-# PCRRecord 模型現在從 pcr_models.py 匯入，因此這裡不再需要重複定義。
-# class PCRRecord(BaseModel):
-#     pcr_reg_no: str
-#     pcr_source_type: Optional[str]
-#     document_name: Optional[str]
-#     developer: Optional[str]
-#     version: Optional[str]
-#     approval_date: Optional[str]
-#     effective_date: Optional[str]
-#     product_scope: Optional[str]
-#     download_link: Optional[str]
-#     feedback_link: Optional[str]
-#     ccc_codes: Optional[str]
+# 向量檢索專用的執行緒池：Chroma 的查詢是同步的 (HNSW 在 C++ 中執行時會釋放 GIL)，
+# 放到執行緒中才不會阻塞事件迴圈，且同時到達的查詢可以平行使用多個核心；
+# 與 asyncio 預設執行緒池分開，避免和其他零碎的 I/O 工作互相排隊
+_HNSW_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="chroma-hnsw")
+
+
+def _fts_phrase(search: str) -> str:
+    """將使用者輸入包成 FTS5 片語，避免被解析為 FTS 查詢語法。"""
+    return '"' + search.replace('"', '""') + '"'
 
 
 async def get_pcr_records_from_db(
@@ -33,8 +36,8 @@ async def get_pcr_records_from_db(
     從資料庫中獲取 PCR 記錄列表。
     這個函數包含了實際的資料庫查詢邏輯，可以被多個地方重複使用。
     """
-    conn = None
     try:
+        # 共用連線由 db.py 管理，不需在此關閉
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -42,35 +45,107 @@ async def get_pcr_records_from_db(
         params = []
         where_clauses = []
 
-        if search:
-            search_term_lower = f"%{search.lower()}%"
+        if search and len(search) >= FTS_MIN_QUERY_LENGTH and fts_index_available():
+            # 以 FTS5 索引比對 (trigram 片語查詢即不分大小寫的子字串比對)，
+            # 只查詢原本 LIKE 比對的三個欄位，並依 rowid 排序讓分頁結果與全表掃描一致
+            query = (
+                f"SELECT r.* FROM {FTS_TABLE} JOIN pcr_records r ON r.rowid = {FTS_TABLE}.rowid"
+            )
+            where_clauses.append(f"{FTS_TABLE} MATCH ?")
+            params.append(
+                "{document_name developer product_scope} : " + _fts_phrase(search)
+            )
+            order_by = " ORDER BY r.rowid"
+        elif search:
+            # SQLite 的 LIKE 本身即不分 (ASCII) 大小寫，不需對每列每個欄位呼叫 LOWER()
+            search_term = f"%{search}%"
             where_clauses.append(
-                "(LOWER(document_name) LIKE ? OR LOWER(developer) LIKE ? OR LOWER(product_scope) LIKE ?)"
+                "(document_name LIKE ? OR developer LIKE ? OR product_scope LIKE ?)"
             )
-            params.extend([search_term_lower, search_term_lower, search_term_lower])
+            params.extend([search_term, search_term, search_term])
+            order_by = ""
+        else:
+            order_by = ""
 
         if where_clauses:
             query += " WHERE " + " AND ".join(where_clauses)
 
-        query += " LIMIT ? OFFSET ?"
+        query += order_by + " LIMIT ? OFFSET ?"
         params.extend([limit, skip])
 
-        logger.info(f"執行服務層查詢: {query}，參數: {params}")
+        logger.info("執行服務層查詢: %s，參數: %s", query, params)
         cursor.execute(query, params)
         records = cursor.fetchall()
 
         # 將查詢結果轉換為 PCRRecord 模型列表
-        return [PCRRecord(**record) for record in records]
+        # 資料來自我們自己寫入的資料表 (欄位與模型一致)，以 model_construct 略過逐欄位驗證
+        return [PCRRecord.model_construct(**record) for record in records]
 
     except sqlite3.Error as e:
-        logger.error(f"服務層資料庫查詢失敗: {e}")
+        logger.error("服務層資料庫查詢失敗: %s", e)
         # 這裡不直接拋出 HTTPException，而是拋出普通的 Exception，
         # 讓上層 (router) 決定如何處理 HTTP 錯誤
         raise Exception(f"資料庫查詢失敗: {e}")
-    finally:
-        if conn:
-            conn.close()
-            logger.info("服務層資料庫連線已關閉。")
+
+
+async def search_pcr_records_keyword(search: str, limit: int = 3) -> List[PCRRecord]:
+    """
+    關鍵字查詢 PCR 記錄：優先使用 FTS5 全文索引 (依 BM25 排序)，
+    查詢太短 (trigram 無法比對) 或 FTS 不可用時，退回 get_pcr_records_from_db 的 LIKE 查詢。
+    """
+    search = search.strip()
+    if len(search) < FTS_MIN_QUERY_LENGTH or not fts_index_available():
+        return await get_pcr_records_from_db(search=search, limit=limit)
+
+    try:
+        conn = get_db_connection()
+        rows = conn.execute(
+            f"SELECT r.* FROM {FTS_TABLE} JOIN pcr_records r ON r.rowid = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH ? ORDER BY bm25({FTS_TABLE}) LIMIT ?",
+            (_fts_phrase(search), limit),
+        ).fetchall()
+        return [PCRRecord.model_construct(**row) for row in rows]
+    except sqlite3.Error as e:
+        logger.error("FTS 查詢失敗: %s", e)
+        raise Exception(f"資料庫查詢失敗: {e}")
+
+
+async def get_pcr_record_by_reg_no(pcr_reg_no: str) -> Optional[PCRRecord]:
+    """以 PCR 登錄編號 (主鍵) 精確查詢單筆記錄；找不到時返回 None。"""
+    try:
+        row = get_db_connection().execute(
+            "SELECT * FROM pcr_records WHERE pcr_reg_no = ?", (pcr_reg_no,)
+        ).fetchone()
+        return PCRRecord.model_construct(**row) if row else None
+    except sqlite3.Error as e:
+        logger.error("服務層資料庫查詢失敗: %s", e)
+        raise Exception(f"資料庫查詢失敗: {e}")
+
+
+async def get_pcr_records_by_ccc(ccc_code: str, limit: int = 3) -> List[PCRRecord]:
+    """
+    以 CCC Code 查詢 PCR 記錄，只比對 ccc_codes 與 product_scope 欄位
+    (ccc_codes 以分號分隔，無法用 = 比對；目前的資料中代碼多半只出現在 product_scope 的說明文字裡)：
+    FTS 可用時以限定這兩欄的片語查詢走索引 (上層代碼也會比對到其下的細項代碼)，否則退回 LIKE。
+    """
+    try:
+        conn = get_db_connection()
+        if len(ccc_code) >= FTS_MIN_QUERY_LENGTH and fts_index_available():
+            rows = conn.execute(
+                f"SELECT r.* FROM {FTS_TABLE} JOIN pcr_records r ON r.rowid = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH ? ORDER BY r.rowid LIMIT ?",
+                ("{product_scope ccc_codes} : " + _fts_phrase(ccc_code), limit),
+            ).fetchall()
+        else:
+            search_term = f"%{ccc_code}%"
+            rows = conn.execute(
+                "SELECT * FROM pcr_records WHERE ccc_codes LIKE ? OR product_scope LIKE ? LIMIT ?",
+                (search_term, search_term, limit),
+            ).fetchall()
+        return [PCRRecord.model_construct(**row) for row in rows]
+    except sqlite3.Error as e:
+        logger.error("CCC Code 查詢失敗: %s", e)
+        raise Exception(f"資料庫查詢失敗: {e}")
 
 
 async def get_pcr_records_from_chroma(
@@ -80,6 +155,7 @@ async def get_pcr_records_from_chroma(
     search: Optional[str] = None,
     k_chunks_initial: int = 100,  # 初次檢索的文本塊數量 K
     top_n_documents: int = 10,  # 最終要返回的最相關文件數量 N
+    query_embedding: Optional[List[float]] = None,  # 已計算好的查詢向量 (可省去重複嵌入)
 ) -> List[PCRRecord]:
     """
     執行文件級 RAG 檢索。首先定位最相關的 Top N 文件，並僅使用首次檢索到的相關文本塊作為上下文。
@@ -92,35 +168,28 @@ async def get_pcr_records_from_chroma(
 
     try:
         # 步驟 1: 檢索最相關的 K 個文本塊 (Chunk)，作為定位文件的訊號和上下文來源
-        initial_chunks = db.similarity_search(search, k=k_chunks_initial)
+        loop = asyncio.get_running_loop()
+        if query_embedding is not None:
+            initial_chunks = await loop.run_in_executor(
+                _HNSW_POOL,
+                lambda: db.similarity_search_by_vector(
+                    query_embedding, k=k_chunks_initial
+                ),
+            )
+        else:
+            initial_chunks = await loop.run_in_executor(
+                _HNSW_POOL, lambda: db.similarity_search(search, k=k_chunks_initial)
+            )
 
         if not initial_chunks:
-            logger.info(f"查詢 '{search}' 未找到任何相關文本塊。")
+            logger.info("查詢 '%s' 未找到任何相關文本塊。", search)
             return []
 
         # 步驟 2: 匯總並篩選出最相關的 Top N 個文件 ID (fid)
         top_doc_fids = get_top_n_document_fids(initial_chunks, top_n_documents)
 
-        # 步驟 3: 聚合內容並轉換為 PCRRecord 輸出格式 (僅使用 initial_chunks 中的內容)
-
-        # document_context 現在以 fid 作為鍵 (key)
-        document_context: Dict[str, PCRRecord] = {}
-
-        # 僅遍歷首次檢索到的文本塊
-        for chunk in initial_chunks:
-            fid = chunk.metadata.get("fid")
-
-            # 僅處理屬於 Top N 文件的文本塊
-            if fid and fid in top_doc_fids:
-                # 初始化文件結構並累積文本塊內容
-                if fid not in document_context:
-                    document_context[fid] = PCRRecord(
-                        **chunk.metadata,  # 保留所有原始 metadata
-                        page_contents=[],
-                    )
-
-                # 將該文本塊的內容加入上下文
-                document_context[fid].page_contents.append(chunk.page_content)
+        # 步驟 3: 聚合內容 (僅使用 initial_chunks 中的內容)，document_context 以 fid 作為鍵 (key)
+        document_context = _aggregate_chunks(initial_chunks, set(top_doc_fids))
 
         # 步驟 4: 轉換為最終的 PCRRecord 列表 (保持 Top N 的排名順序)
         final_records: List[PCRRecord] = []
@@ -128,58 +197,83 @@ async def get_pcr_records_from_chroma(
         # 依照排名順序 (top_doc_fids) 建立輸出記錄
         for i, fid in enumerate(top_doc_fids):
             if fid in document_context:
-                record = document_context[fid]
+                context = document_context[fid]
 
                 # 將所有文本塊內容用分隔符合併成一個長字符串，供 LLM 使用
-                full_context = "\n\n--- 文件內文本塊分隔線 ---\n\n".join(
-                    record.page_contents
+                context["page_content"] = "\n\n--- 文件內文本塊分隔線 ---\n\n".join(
+                    context["page_contents"]
                 )
-                record.page_content = full_context  # 將聚合內容存入 page_content 欄位
 
-                # 建立 PCRRecord 實例 (包含聚合的上下文)
+                # 建立 PCRRecord 實例 (包含聚合的上下文)；每個文件只建立並驗證一次
+                # (Chroma 的 metadata 可能來自不同的索引腳本，型別不一定與模型一致，因此保留驗證)
+                record = PCRRecord(**context)
                 final_records.append(record)
 
-                # 輸出確認資訊
-                print(f"【結果 {i+1} - 文件級 (僅首次檢索內容)】 文件 ID (fid): {fid}")
-                print(f"  文件名: {record.document_name}")
-                print(f"  已合併 {len(record.page_contents)} 個首次檢索到的文本塊")
-                print(f"  開發者: {record.developer}")
-                print("-" * 20)
+                # 輸出確認資訊 (除錯用；未啟用 DEBUG 時不會格式化字串)
+                logger.debug(
+                    "【結果 %s - 文件級 (僅首次檢索內容)】 文件 ID (fid): %s，文件名: %s，"
+                    "已合併 %s 個首次檢索到的文本塊，開發者: %s",
+                    i + 1,
+                    fid,
+                    record.document_name,
+                    len(record.page_contents),
+                    record.developer,
+                )
             else:
                 logger.warning(
-                    f"文件 ID '{fid}' 在聚合步驟中丟失，可能是因為在 initial_chunks 中沒有足夠的 metadata。"
+                    "文件 ID '%s' 在聚合步驟中丟失，可能是因為在 initial_chunks 中沒有足夠的 metadata。",
+                    fid,
                 )
 
         logger.info(
-            f"成功為查詢 '{search}' 處理並返回 {len(final_records)} 個文件級記錄。"
+            "成功為查詢 '%s' 處理並返回 %s 個文件級記錄。", search, len(final_records)
         )
         return final_records
 
     except Exception as e:
-        logger.error(f"服務層資料庫查詢失敗: {e}")
+        logger.error("服務層資料庫查詢失敗: %s", e)
         # 拋出普通的 Exception，讓上層 (router) 決定如何處理 HTTP 錯誤
         raise Exception(f"資料庫查詢失敗: {e}")
     finally:
         pass
 
 
+def _aggregate_chunks(
+    chunks: List[Document], top_fids: Set[str]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    將屬於 Top N 文件的文本塊依 fid 聚合為普通 dict (保留所有原始 metadata，並累積 page_contents)，
+    最後由呼叫端每個文件只建立一次 PCRRecord。
+    """
+    document_context: Dict[str, Dict[str, Any]] = {}
+    for chunk in chunks:
+        fid = chunk.metadata.get("fid")
+        if fid and fid in top_fids:
+            context = document_context.get(fid)
+            if context is None:
+                context = document_context[fid] = {**chunk.metadata, "page_contents": []}
+            context["page_contents"].append(chunk.page_content)
+    return document_context
+
+
 def get_top_n_document_fids(chunks: List[Document], top_n: int) -> List[str]:
     """
     從檢索到的文本塊列表中，計算哪個文件的 document_name 出現的次數最多，
     並返回得分最高的前 N 個獨特的 document_name 列表 (FID)。
     """
-    # 1. 提取 document_name (模擬 fid)
-    fids = [doc.metadata.get("fid") for doc in chunks if doc.metadata.get("fid")]
-
-    # 2. 計算每個文件的出現頻率。頻率越高，相關性越高。
-    fid_counts = Counter(fids)
-
-    # 3. 根據計數降序排序，並取前 top_n
-    top_ids_with_counts = fid_counts.most_common(top_n)
-
-    # 4. 提取 document_name
-    top_fids = [fid for fid, count in top_ids_with_counts]
-
-    logger.info(f"從 {len(fids)} 個文本塊中，成功篩選出 Top {top_n} 個文件: {top_fids}")
+    # 1. 提取 fid 並計算每個文件的出現頻率 (每個文本塊只查詢一次 metadata)。頻率越高，相關性越高。
+    fid_counts = Counter(
+        fid for doc in chunks if (fid := doc.metadata.get("fid"))
+    )
+
+    # 2. 根據計數降序排序，取前 top_n 的 fid (保持排名順序)
+    top_fids = [fid for fid, _ in fid_counts.most_common(top_n)]
+
+    logger.info(
+        "從 %s 個文本塊中，成功篩選出 Top %s 個文件: %s",
+        fid_counts.total(),
+        top_n,
+        top_fids,
+    )
 
     return top_fids
@@ -1,33 +1,35 @@
 import os
-import json
+import orjson
 import re
+from functools import lru_cache
 from typing import Dict, List, Any
 
 # --- 設定 ---
 JSON_FILE = "pcr_list_scraped.json"
 
+# 預先編譯的正規表示式 (每筆數據都會用到)
+_FID_PARAM_RE = re.compile(r"fid=([^&]+)")
+_GUID_RE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}",
+    re.IGNORECASE,
+)
 
+
+@lru_cache(maxsize=None)  # 純函數：重複的連結只需解析一次
 def extract_fid_from_link(link: str) -> str:
     """
     從 download_link 參數中提取唯一的 FID 識別碼。
     FID 格式假設為 GUID-YY-NNN (例如: ...-23-015)。
     """
-    print(f"正在處理連結: {link}")
-    fid_match = re.search(r"fid=([^&]+)", link)
+    fid_match = _FID_PARAM_RE.search(link)
     if not fid_match:
         raise ValueError(f"在連結中找不到 fid 參數: {link}")
 
     fid_param_value = fid_match.group(1)
-    print(f"提取到的 fid 參數值: {fid_param_value}")
 
     # 尋找 FID 結尾 (-XX-YYY)，它位於 GUID 之後，文件編碼名稱之前
     # 正則表達式匹配: ([GUID]-[YY]-[NNN])[+-][Encoded Filename...]
-    match = re.fullmatch(
-        r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}",
-        fid_param_value,
-        re.IGNORECASE,
-    )
-    print(f"正則表達式匹配結果: {match}")
+    match = _GUID_RE.fullmatch(fid_param_value)
 
     if match:
         return match.group(0)
@@ -45,8 +47,8 @@ def update_json_with_fid():
 
     try:
         # 1. 載入數據
-        with open(JSON_FILE, "r", encoding="utf-8") as f:
-            data: List[Dict[str, Any]] = json.load(f)
+        with open(JSON_FILE, "rb") as f:
+            data: List[Dict[str, Any]] = orjson.loads(f.read())
 
         print(f"成功載入 {len(data)} 筆數據。開始處理...")
 
@@ -68,14 +70,14 @@ def update_json_with_fid():
                 item["fid"] = "NoLink"
 
         # 3. 儲存修改後的數據
-        with open(JSON_FILE, "w", encoding="utf-8") as f:
-            # 使用 indent=4 讓 JSON 文件保持美觀易讀
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        with open(JSON_FILE, "wb") as f:
+            # 以 orjson 直接輸出 UTF-8，縮排與 pcr_scraper.py 產生的檔案相同 (2 格)
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
         print(f"\n成功處理並更新 {processed_count} 筆數據。")
         print(f"檔案 {JSON_FILE} 已更新完成。")
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"錯誤：檔案 {JSON_FILE} 不是有效的 JSON 格式。")
     except Exception as e:
         print(f"處理檔案時發生未預期的錯誤: {e}")
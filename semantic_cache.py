@@ -0,0 +1,71 @@
+import logging
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    以查詢向量為鍵的語義快取 (in-process, LRU)。
+    當新查詢與已快取查詢的餘弦相似度 >= threshold 時，直接回傳快取的檢索結果，
+    省去向量資料庫的 ANN 檢索。
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 512):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # {entry_id: (normalized_vec, limit, records)}，依最近使用順序排列
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next_id = 0
+        # 快取所有向量組成的矩陣，僅在內容變動時重建
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self._matrix_limits: Optional[np.ndarray] = None
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        arr = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm else arr
+
+    def _rebuild_matrix(self) -> None:
+        self._matrix_ids = list(self._entries.keys())
+        if self._matrix_ids:
+            self._matrix = np.vstack([self._entries[i][0] for i in self._matrix_ids])
+            self._matrix_limits = np.array([self._entries[i][1] for i in self._matrix_ids])
+        else:
+            self._matrix = None
+            self._matrix_limits = None
+
+    def lookup(self, query_vec, limit: int) -> Optional[List[Any]]:
+        """回傳相似度最高且 limit 相同的快取結果；未命中時回傳 None。"""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._rebuild_matrix()
+
+        # 先排除 limit 不同的項目再取最相似者，避免最相似的項目 limit 不同時錯過其他可用的項目
+        same_limit = self._matrix_limits == limit
+        if not same_limit.any():
+            return None
+        scores = np.where(same_limit, self._matrix @ self._normalize(query_vec), -np.inf)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        entry_id = self._matrix_ids[best]
+        records = self._entries[entry_id][2]
+        self._entries.move_to_end(entry_id)
+        logger.info("語義快取命中 (相似度 %.3f)", scores[best])
+        return records
+
+    def store(self, query_vec, limit: int, records: List[Any]) -> None:
+        """存入一筆查詢結果，超過容量時淘汰最久未使用的項目。"""
+        self._entries[self._next_id] = (self._normalize(query_vec), limit, records)
+        self._next_id += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
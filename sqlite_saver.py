@@ -4,6 +4,29 @@ import json  # 引入 json 模組以讀取 JSON 檔案
 
 logger = logging.getLogger(__name__)
 
+# pcr_records 的 FTS5 全文索引 (名稱與 db.py 的 FTS_TABLE 相同)：以 pcr_records 作為外部內容表，
+# trigram 分詞可對中文做子字串比對；伺服器只讀取此索引，由這裡負責建立與更新
+FTS_TABLE = "pcr_fts"
+
+
+def rebuild_fts_index(conn: sqlite3.Connection) -> None:
+    """
+    建立 (若不存在) 並重建 FTS5 全文索引。
+    INSERT OR REPLACE 會以新的 rowid 刪除並重新插入記錄，外部內容表不會自動同步，因此每次寫入後都要重建。
+    SQLite 不支援 FTS5 / trigram 時只記錄警告 (伺服器會改用 LIKE 查詢)。
+    """
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "document_name, developer, product_scope, ccc_codes, "
+            "content='pcr_records', tokenize='trigram')"
+        )
+        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+        conn.commit()
+        logger.info("已重建 FTS5 全文索引 '%s'。", FTS_TABLE)
+    except sqlite3.Error as e:
+        logger.warning("無法建立 FTS5 全文索引 (伺服器將改用 LIKE 查詢): %s", e)
+
 
 def save_to_sqlite(
     db_name: str = "pcr_list.db", json_file: str = "pcr_list_scraped.json"
@@ -34,6 +57,9 @@ def save_to_sqlite(
             return
 
         conn = sqlite3.connect(db_name)
+        # 資料庫只有此處設定 WAL (db.py 的伺服器連線為唯讀，不變更日誌模式)；批次寫入時 NORMAL 同步在 WAL 下仍安全且較快
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
         cursor = conn.cursor()
 
         # 建立表格，如果它不存在。
@@ -70,33 +96,47 @@ def save_to_sqlite(
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
 
-        # 遍歷數據並插入到資料庫
-        for entry in data:
-            try:
-                # 將字典中的值按照 SQL 語句的順序提取
-                # 確保所有鍵都存在，否則提供空字串作為預設值
-                values = (
-                    entry.get("pcr_reg_no", ""),
-                    entry.get("pcr_source_type", ""),
-                    entry.get("document_name", ""),
-                    entry.get("developer", ""),
-                    entry.get("version", ""),
-                    entry.get("approval_date", ""),
-                    entry.get("effective_date", ""),
-                    entry.get("product_scope", ""),
-                    entry.get("download_link", ""),
-                    entry.get("feedback_link", ""),
-                    entry.get("ccc_codes", ""),
-                )
-                cursor.execute(insert_sql, values)
-            except sqlite3.Error as e:
-                logger.error(
-                    f"插入數據時發生錯誤 (PCR 登錄編號: {entry.get('pcr_reg_no', 'N/A')}): {e}"
-                )
+        # 將字典中的值按照 SQL 語句的順序提取
+        # 確保所有鍵都存在，否則提供空字串作為預設值
+        rows = [
+            (
+                entry.get("pcr_reg_no", ""),
+                entry.get("pcr_source_type", ""),
+                entry.get("document_name", ""),
+                entry.get("developer", ""),
+                entry.get("version", ""),
+                entry.get("approval_date", ""),
+                entry.get("effective_date", ""),
+                entry.get("product_scope", ""),
+                entry.get("download_link", ""),
+                entry.get("feedback_link", ""),
+                entry.get("ccc_codes", ""),
+            )
+            for entry in data
+        ]
+
+        # 在單一交易中以 executemany 批次插入，由 SQLite 在 C 層逐筆處理
+        try:
+            cursor.execute("BEGIN")
+            cursor.executemany(insert_sql, rows)
+        except sqlite3.Error as e:
+            # 批次失敗時回復，改為逐筆插入以找出 (並記錄) 有問題的記錄
+            conn.rollback()
+            logger.warning(f"批次插入失敗，改為逐筆插入: {e}")
+            for values in rows:
+                try:
+                    cursor.execute(insert_sql, values)
+                except sqlite3.Error as row_error:
+                    logger.error(
+                        f"插入數據時發生錯誤 (PCR 登錄編號: {values[0] or 'N/A'}): {row_error}"
+                    )
 
         conn.commit()  # 提交所有變更
         logger.info(f"所有 PCR 數據已成功儲存到 '{db_name}'。")
 
+        # 重建 FTS5 全文索引 (外部內容表) 以反映本次寫入
+        rebuild_fts_index(conn)
+
     except sqlite3.Error as e:
         logger.error(f"SQLite 資料庫操作失敗: {e}")
     finally:
@@ -1,73 +1,412 @@
+import asyncio
 import logging
-from typing import List, Optional
+import os
+import re
+import weakref
+import orjson
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from cachetools import TTLCache
 from langchain_core.tools import tool  # 引入 tool 裝飾器
 
 # 從 pcr_services.py 匯入實際的資料庫查詢函數和 PCRRecord 模型
-from pcr_services import get_pcr_records_from_db, get_pcr_records_from_chroma, PCRRecord
-from chroma_manager import chroma_manager, get_chroma_db
+from pcr_services import (
+    get_pcr_records_from_db,
+    get_pcr_records_from_chroma,
+    get_pcr_record_by_reg_no,
+    get_pcr_records_by_ccc,
+    search_pcr_records_keyword,
+    PCRRecord,
+)
+from chroma_manager import chroma_manager, embed_queries, get_chroma_db
+from cache import get_redis_client  # 共用的 Redis 連線 (未設定 REDIS_URL 時為 None)
 
 logger = logging.getLogger(__name__)
 
+# 工具查詢的逾時秒數 (可由環境變數調整)：限制尾端延遲，逾時回傳空結果而不是讓 Agent 無限等待
+# 向量檢索的首次查詢可能需要載入 HNSW 索引，預算較寬
+DB_TOOL_TIMEOUT = float(os.getenv("DB_TOOL_TIMEOUT_SECONDS", "3"))
+CHROMA_TOOL_TIMEOUT = float(os.getenv("CHROMA_TOOL_TIMEOUT_SECONDS", "5"))
+
+# pcr_database_search 的查詢結果快取 (資料庫內容固定，相同查詢結果相同)；TTL 讓資料更新後能逐步生效
+_db_search_cache: TTLCache = TTLCache(maxsize=4096, ttl=1800)
+# pcr_hybrid_search 中關鍵字查詢部分的結果快取 (與 _db_search_cache 不同，不含向量檢索的補充)
+_keyword_search_cache: TTLCache = TTLCache(maxsize=4096, ttl=1800)
+# pcr_hybrid_search 合併去重後最多回傳的記錄數
+HYBRID_MAX_RESULTS = 5
+# 向量檢索的最短查詢長度：太短的查詢 (例如單一字元) 只會得到任意的「最接近」結果
+MIN_CHROMA_QUERY_LENGTH = 2
+# pcr_chroma_search 的查詢結果快取：Agent 重試時常在短時間內重複相同查詢
+_chroma_search_cache: TTLCache = TTLCache(maxsize=512, ttl=60)
+# 查詢中的 CCC Code (例如 8517.12 或 8517.12.00)。
+_CCC_CODE_RE = re.compile(r"(?<![\d.])\d{4}\.\d{2}(?:\.\d{2})?(?![\d])")
+# PCR 登錄編號 (例如 24-011)；整個查詢就是編號時直接以主鍵查詢
+_PCR_REG_NO_RE = re.compile(r"\d{2}-\d{3}")
+# 查詢中的快取鍵對應的鎖：同一查詢同時未命中時只執行一次，其他呼叫等待結果 (沒有人等待時自動釋放)
+_search_locks: "weakref.WeakValueDictionary[tuple, asyncio.Lock]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _error_result(error: BaseException) -> List[dict]:
+    """
+    工具失敗時的回傳值：單一元素並帶有 _error 欄位，讓 Agent 分辨「查詢失敗」與「查無資料」，
+    不會把失敗當成沒有結果而換句話反覆重試。
+    """
+    return [{"_error": type(error).__name__, "_message": str(error)[:200]}]
+
+
+def normalize_query(text: str) -> str:
+    """
+    將查詢正規化 (合併空白、轉小寫)，作為快取鍵。
+    """
+    return " ".join(text.split()).lower()
+
+
+# 向量檢索結果交給模型的內文摘要長度 (與 chat_router 的 snippet 相同)
+SNIPPET_LENGTH = 800
+# 不交給模型的欄位：聚合的文本塊列表與其完整串接 (每筆可達數十 KB)，改以 snippet 取代
+_BULK_CONTENT_FIELDS = {"page_contents", "page_content"}
+
+
+def _to_tool_result(record: PCRRecord) -> dict:
+    """
+    將 PCRRecord 轉成交給模型 (並寫入快取) 的 dict：保留所有 metadata 欄位，
+    向量檢索的聚合內文只保留前 SNIPPET_LENGTH 個字元作為 snippet，避免工具訊息超出模型的上下文。
+    """
+    result = record.model_dump(mode="json", exclude=_BULK_CONTENT_FIELDS)
+    if record.page_content:
+        result["snippet"] = record.page_content[:SNIPPET_LENGTH]
+    return result
+
+
+async def _load_persisted(redis_key: str) -> Optional[List[dict]]:
+    """從 Redis 讀取先前 (可能是重啟前的 worker) 存入的查詢結果；Redis 未設定或失敗時返回 None。"""
+    client = get_redis_client()
+    if client is None:
+        return None
+    try:
+        raw = await client.get(redis_key)
+    except Exception as e:
+        logger.warning("讀取 Redis 查詢快取失敗: %s", e)
+        return None
+    return orjson.loads(raw) if raw else None
+
+
+async def _persist(redis_key: str, records: List[dict], ttl: float) -> None:
+    """將查詢結果 (dict 列表) 以與記憶體快取相同的 TTL 寫入 Redis；失敗時只記錄，不影響查詢。"""
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        await client.set(redis_key, orjson.dumps(records), ex=int(ttl))
+    except Exception as e:
+        logger.warning("寫入 Redis 查詢快取失敗: %s", e)
+
+
+async def _cached_search(
+    cache: TTLCache,
+    query: str,
+    search: Callable[[str], Awaitable[List[PCRRecord]]],
+    redis_prefix: Optional[str] = None,
+) -> List[dict]:
+    """
+    以正規化後的查詢 (合併空白、轉小寫) 為鍵查詢快取，未命中時執行 search 並寫入快取。
+    結果在寫入快取前以 _to_tool_result 轉成 dict 一次 (工具結果最終以 JSON 交給模型)，快取命中時不必再轉換。
+    有 redis_prefix 且設定了 REDIS_URL 時，記憶體快取之後再查 Redis，讓結果在 worker 重啟後仍可使用；
+    未設定 REDIS_URL 時只有記憶體快取，重啟後即失效 (容器的檔案系統每次部署都會重置，磁碟快取也留不住)。
+    search 拋出例外時不寫入快取，由呼叫端處理。
+    """
+    cache_key = normalize_query(query)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        logger.info("工具執行結果 (快取): 找到 %s 條記錄。", len(cached))
+        return cached
+
+    lock_key = (id(cache), cache_key)
+    lock = _search_locks.get(lock_key)
+    if lock is None:
+        lock = _search_locks[lock_key] = asyncio.Lock()
+    async with lock:
+        # 等待期間其他呼叫可能已完成相同查詢
+        cached = cache.get(cache_key)
+        if cached is None:
+            redis_key = f"{redis_prefix}:{cache_key}" if redis_prefix else None
+            if redis_key:
+                cached = await _load_persisted(redis_key)
+            if cached is None:
+                records = await search(query)
+                cached = [_to_tool_result(record) for record in records]
+                if redis_key:
+                    await _persist(redis_key, cached, cache.ttl)
+            cache[cache_key] = cached
+    return cached
+
+
+# 初始化完成後的 Chroma 實例 (之後的工具呼叫直接使用，不再檢查與查找)
+_chroma_db: Optional[Any] = None
+_chroma_init_lock = asyncio.Lock()
+
+
+async def _ensure_chroma_db():
+    """
+    回傳 Chroma 實例；尚未初始化時 (main.py 啟動時通常已初始化) 在執行緒中載入，
+    以鎖確保同時到達的呼叫只初始化一次。初始化失敗時拋出例外。
+    """
+    global _chroma_db
+    if _chroma_db is None:
+        async with _chroma_init_lock:
+            if _chroma_db is None:
+                if not chroma_manager.is_initialized:
+                    await asyncio.to_thread(chroma_manager.initialize_db)
+                _chroma_db = get_chroma_db()
+    return _chroma_db
+
+
+async def _search_keyword(query: str) -> List[PCRRecord]:
+    """關鍵字 (FTS5 / LIKE) 查詢前 3 筆。"""
+    return await search_pcr_records_keyword(query, limit=3)
+
+
+async def _search_db_then_chroma(query: str) -> List[PCRRecord]:
+    """混合檢索：先以關鍵字 (FTS5 / LIKE) 查詢，沒有命中時才使用向量檢索做語義補充。"""
+    # 快速路徑：整個查詢就是 PCR 登錄編號時直接以主鍵查詢 (找不到時仍做一般查詢)
+    reg_no = query.strip()
+    if _PCR_REG_NO_RE.fullmatch(reg_no):
+        record = await get_pcr_record_by_reg_no(reg_no)
+        if record is not None:
+            return [record]
+
+    ccc_codes = _CCC_CODE_RE.findall(query)
+    if ccc_codes:
+        # 查詢含 CCC Code 時先只以代碼本身做精確 (片語) 比對，不拿整句做模糊比對；
+        # 代碼查無記錄時仍退回下方一般的關鍵字 / 向量檢索
+        by_reg_no: dict = {}
+        for code in dict.fromkeys(ccc_codes):
+            for record in await get_pcr_records_by_ccc(code, limit=3):
+                by_reg_no.setdefault(record.pcr_reg_no, record)
+        if by_reg_no:
+            return list(by_reg_no.values())[:3]
+
+    records = await search_pcr_records_keyword(query, limit=3)
+    # 只在 Chroma 已載入時補充，不為此觸發初始化
+    if not records and chroma_manager.is_initialized:
+        logger.info("關鍵字查詢無結果，改用向量檢索。")
+        records = await get_pcr_records_from_chroma(
+            get_chroma_db(), skip=0, limit=3, search=query, top_n_documents=3
+        )
+    return records
+
+
+# 合併同時到達的 pcr_chroma_search 查詢：在 CHROMA_BATCH_WINDOW 秒內 (或累積 CHROMA_BATCH_MAX 筆時)
+# 以一次 embed_documents 計算所有查詢向量，模型一次前向傳播處理整批，而不是每個查詢各跑一次
+CHROMA_BATCH_WINDOW = 0.01
+CHROMA_BATCH_MAX = 8
+_pending_embed_batch: Optional[List[Tuple[str, asyncio.Future]]] = None
+# 背景批次任務 (保留參照，避免任務在完成前被垃圾回收)
+_embed_batch_tasks: set = set()
+
+
+def _start_embed_batch_task(coro) -> None:
+    task = asyncio.create_task(coro)
+    _embed_batch_tasks.add(task)
+    task.add_done_callback(_embed_batch_tasks.discard)
+
+
+async def _run_embed_batch(batch: List[Tuple[str, asyncio.Future]]) -> None:
+    """在執行緒中一次計算整批查詢向量 (不阻塞事件迴圈，已快取的查詢不重算)，再分送給各個等待者。"""
+    try:
+        vectors = await asyncio.to_thread(
+            embed_queries, [query for query, _ in batch]
+        )
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, future), vector in zip(batch, vectors):
+        if not future.done():  # 等待者可能已被取消
+            future.set_result(vector)
+
+
+async def _flush_embed_batch_later(batch: List[Tuple[str, asyncio.Future]]) -> None:
+    """等待合併時間窗結束後送出批次 (若批次已因數量達上限提前送出則略過)。"""
+    global _pending_embed_batch
+    await asyncio.sleep(CHROMA_BATCH_WINDOW)
+    if _pending_embed_batch is batch:
+        _pending_embed_batch = None
+        await _run_embed_batch(batch)
+
+
+async def _embed_query_batched(query: str) -> List[float]:
+    """將查詢加入目前的批次，等待整批嵌入完成後回傳此查詢的向量。"""
+    global _pending_embed_batch
+    batch = _pending_embed_batch
+    if batch is None:
+        batch = _pending_embed_batch = []
+        _start_embed_batch_task(_flush_embed_batch_later(batch))
+    future = asyncio.get_running_loop().create_future()
+    batch.append((query, future))
+    if len(batch) >= CHROMA_BATCH_MAX:
+        _pending_embed_batch = None
+        _start_embed_batch_task(_run_embed_batch(batch))
+    return await future
+
+
+async def _search_chroma(query: str) -> List[PCRRecord]:
+    """使用向量檢索服務查詢（最多回傳 3 份文件，以便 Agent 處理多個結果）。"""
+    db = await _ensure_chroma_db()
+    query_embedding = await _embed_query_batched(query)
+    return await get_pcr_records_from_chroma(
+        db,
+        skip=0,
+        limit=3,
+        search=query,
+        query_embedding=query_embedding,
+        top_n_documents=3,
+    )
+
 
 # 將 get_pcr_records_from_db 函數包裝成 LangChain Tool
 # 使用 @tool 裝飾器，並提供清晰的名稱和描述
 @tool
-async def pcr_database_search(query: str) -> List[PCRRecord]:
+async def pcr_database_search(query: str) -> List[dict]:
     """
     用於查詢環境部產品碳足跡PCR資料庫的工具。
     根據產品名稱、CCC Code、制定者或產品範圍進行模糊搜尋。
-    返回一個包含PCR記錄的列表。如果沒有找到，返回空列表。
+    返回一個包含PCR記錄 (dict) 的列表。如果沒有找到，返回空列表。
+    若結果只有一筆且包含 `_error` 欄位，代表查詢失敗 (不是查無資料)：請不要換句話重試，直接告知用戶系統暫時無法查詢。
 
     Args:
         query (str): 用戶提供的產品名稱、CCC Code 或其他相關搜尋關鍵字。
 
     Returns:
-        List[PCRRecord]: 找到的PCR記錄列表。
+        List[dict]: 找到的PCR記錄列表 (PCRRecord 的 metadata 欄位；向量檢索補充的記錄另有內文摘要 snippet)。
     """
-    logger.info(f"工具呼叫: pcr_database_search，查詢內容: '{query}'")
+    logger.info("工具呼叫: pcr_database_search，查詢內容: %r", query)
+    if not query or not query.strip():
+        # 空白查詢會比對到所有記錄，直接回傳空結果
+        logger.debug("pcr_database_search 收到空白查詢，略過。")
+        return []
     try:
-        # 呼叫 pcr_services 中的實際查詢函數
-        # 將 limit 從 1 增加到 3，以便 Agent 可以處理多個結果
-        records = await get_pcr_records_from_db(search=query, limit=3)
-        logger.info(f"工具執行結果: 找到 {len(records)} 條記錄。")
+        # 關鍵字查詢沒有命中時會接著做向量檢索，預算取兩者之和
+        records = await asyncio.wait_for(
+            _cached_search(
+                _db_search_cache, query, _search_db_then_chroma, "pcr:db:v2"
+            ),
+            timeout=DB_TOOL_TIMEOUT + CHROMA_TOOL_TIMEOUT,
+        )
+        logger.info("工具執行結果: 找到 %s 條記錄。", len(records))
         return records
+    except asyncio.TimeoutError as e:
+        logger.warning("pcr_database_search 查詢逾時: %r", query)
+        return _error_result(e)
     except Exception as e:
-        logger.error(f"工具執行失敗: {e}")
-        # 工具執行失敗時，返回一個空的 PCRRecord 列表或包含錯誤訊息的特殊對象
-        # 讓 Agent 知道查詢失敗
-        return (
-            []
-        )  # 或者返回 [PCRRecord(pcr_reg_no="ERROR", document_name=f"查詢失敗: {e}")]
+        logger.error("工具執行失敗: %s", e)
+        # 工具執行失敗時，返回帶有錯誤訊息的特殊對象，讓 Agent 知道查詢失敗
+        return _error_result(e)
 
 
 @tool
-async def pcr_chroma_search(query: str) -> List[PCRRecord]:
+async def pcr_chroma_search(query: str) -> List[dict]:
     """
     使用 Chroma 向量索引進行檔案級檢索的工具（RAG-style）。
-    這會呼叫 `get_pcr_records_from_chroma`，返回最相關的 PCRRecord 列表。
+    這會呼叫 `get_pcr_records_from_chroma`，返回最相關的 PCR 記錄 (dict) 列表。
+    若結果只有一筆且包含 `_error` 欄位，代表查詢失敗 (不是查無資料)：請不要換句話重試，直接告知用戶系統暫時無法查詢。
 
     Args:
         query (str): 使用者的查詢文字，會用於向量相似度檢索。
 
     Returns:
-        List[PCRRecord]: 按相關性排序的 PCR 記錄清單（可能為空）。
+        List[dict]: 按相關性排序的 PCR 記錄清單（PCRRecord 的 metadata 欄位與內文摘要 snippet，可能為空）。
     """
-    logger.info(f"工具呼叫: pcr_chroma_search，查詢內容: '{query}'")
+    logger.info("工具呼叫: pcr_chroma_search，查詢內容: %r", query)
+    if not query or len(query.strip()) < MIN_CHROMA_QUERY_LENGTH:
+        # 不為無意義的查詢計算向量與執行 HNSW 檢索
+        logger.debug("pcr_chroma_search 收到過短的查詢 '%s'，略過。", query)
+        return []
     try:
         # 確保 ChromaDB 已初始化（在 main.py 啟動時通常已經初始化）
-        if getattr(chroma_manager, "_db", None) is None:
-            try:
-                chroma_manager.initialize_db()
-            except Exception as init_err:
-                logger.error(f"初始化 ChromaDB 失敗: {init_err}")
-                return []
-
-        db = get_chroma_db()
-
-        # 使用向量檢索服務查詢（將 limit 設為 3，以便 Agent 處理多個結果）
-        records = await get_pcr_records_from_chroma(db, skip=0, limit=3, search=query)
-        logger.info(f"工具執行結果: 在 Chroma 中找到 {len(records)} 條記錄。")
+        try:
+            await _ensure_chroma_db()
+        except Exception as init_err:
+            logger.error("初始化 ChromaDB 失敗: %s", init_err)
+            return _error_result(init_err)
+
+        records = await asyncio.wait_for(
+            _cached_search(_chroma_search_cache, query, _search_chroma),
+            timeout=CHROMA_TOOL_TIMEOUT,
+        )
+        logger.info("工具執行結果: 在 Chroma 中找到 %s 條記錄。", len(records))
         return records
+    except asyncio.TimeoutError as e:
+        logger.warning("pcr_chroma_search 查詢逾時: %r", query)
+        return _error_result(e)
     except Exception as e:
-        logger.exception(f"工具執行失敗 (Chroma): {e}")
+        logger.exception("工具執行失敗 (Chroma): %s", e)
+        return _error_result(e)
+
+
+async def _hybrid_chroma_part(query: str) -> List[dict]:
+    """pcr_hybrid_search 的向量檢索部分；查詢過短時不執行。"""
+    if len(query.strip()) < MIN_CHROMA_QUERY_LENGTH:
+        return []
+    await _ensure_chroma_db()
+    return await _cached_search(_chroma_search_cache, query, _search_chroma)
+
+
+@tool
+async def pcr_hybrid_search(query: str) -> List[dict]:
+    """
+    同時以關鍵字 (產品名稱、CCC Code、制定者或產品範圍) 與 Chroma 向量相似度查詢 PCR 資料，
+    合併兩者的結果並依 PCR 登錄編號 (沒有時依文件識別碼) 去除重複 (關鍵字結果優先)。只有一方失敗時仍回傳另一方的結果。
+    若結果只有一筆且包含 `_error` 欄位，代表查詢失敗 (不是查無資料)：請不要換句話重試，直接告知用戶系統暫時無法查詢。
+
+    Args:
+        query (str): 用戶提供的產品名稱、CCC Code 或其他相關搜尋關鍵字。
+
+    Returns:
+        List[dict]: 找到的PCR記錄列表 (PCRRecord 的 metadata 欄位；向量檢索的記錄另有內文摘要 snippet，最多 5 筆；沒有找到時為空列表)。
+    """
+    logger.info("工具呼叫: pcr_hybrid_search，查詢內容: %r", query)
+    if not query or not query.strip():
+        logger.debug("pcr_hybrid_search 收到空白查詢，略過。")
         return []
+
+    # 兩種查詢互不相依：並行執行，總等待時間為較慢者而非兩者相加；其中一方失敗時仍回傳另一方的結果
+    keyword_result, chroma_result = await asyncio.gather(
+        asyncio.wait_for(
+            _cached_search(
+                _keyword_search_cache, query, _search_keyword, "pcr:keyword"
+            ),
+            timeout=DB_TOOL_TIMEOUT,
+        ),
+        asyncio.wait_for(_hybrid_chroma_part(query), timeout=CHROMA_TOOL_TIMEOUT),
+        return_exceptions=True,
+    )
+
+    seen = set()
+    merged: List[dict] = []
+    errors: List[BaseException] = []
+    for name, result in (("關鍵字", keyword_result), ("Chroma", chroma_result)):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning("pcr_hybrid_search 的%s查詢逾時: %r", name, query)
+            else:
+                logger.error("工具執行失敗 (%s): %s", name, result)
+            errors.append(result)
+            continue
+        for record in result:
+            # 以登錄編號去重；向量檢索的記錄可能沒有登錄編號，改用文件識別碼，兩者皆無時直接保留
+            key = record.get("pcr_reg_no") or record.get("fid")
+            if key:
+                if key in seen:
+                    continue
+                seen.add(key)
+            merged.append(record)
+
+    if len(errors) == 2:
+        return _error_result(errors[0])
+
+    merged = merged[:HYBRID_MAX_RESULTS]
+    logger.info("工具執行結果: 混合查詢找到 %s 條記錄。", len(merged))
+    return merged